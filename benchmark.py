@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import trimesh
+import tran
+from amulet import load_level
+from amulet.level.formats.anvil_world import AnvilFormat
+from amulet_nbt import CompoundTag, ListTag, StringTag, IntTag
+# example: python benchmark.py --pitches 1,0.5 --sizes small,medium --output bench.json
+
+BENCH_START_POS = (0, 128, 0)  # Keeps the synthetic models inside the world height
+SIZES = {
+    # name: (icosphere subdivisions, radius, box subdivisions, texture size)
+    'small': (3, 16, 2, 256),
+    'medium': (5, 32, 4, 1024),
+    'large': (6, 64, 5, 2048),
+}
+
+# Create a throwaway flat world that amulet can load, with 1.18+ height limits
+def create_flat_world(path, game_version=tran.GAME_VERSION):
+    world_format = AnvilFormat(path)
+    world_format.create_and_open(*game_version, overwrite=True)
+    dimensions = CompoundTag()
+    for name in ("overworld", "the_nether", "the_end"):
+        dimensions[f"minecraft:{name}"] = CompoundTag({"type": StringTag(f"minecraft:{name}")})
+    layers = [("minecraft:bedrock", 1), ("minecraft:dirt", 2), ("minecraft:grass_block", 1)]
+    dimensions["minecraft:overworld"]["generator"] = CompoundTag({
+        "type": StringTag("minecraft:flat"),
+        "settings": CompoundTag({
+            "biome": StringTag("minecraft:plains"),
+            "layers": ListTag([CompoundTag({"block": StringTag(block), "height": IntTag(height)}) for block, height in layers]),
+        }),
+    })
+    world_format.root_tag.compound.get_compound("Data")["WorldGenSettings"] = CompoundTag({"dimensions": dimensions})
+    world_format.root_tag.save_to(os.path.join(path, "level.dat"))
+    world_format.close()
+
+# Color the vertices of a mesh with a smooth gradient over its bounds
+def gradient_colors(mesh):
+    extent = np.ptp(mesh.vertices, axis=0)
+    unit = (mesh.vertices - mesh.vertices.min(axis=0)) / np.where(extent > 0, extent, 1)
+    return np.column_stack([unit * 255, np.full(len(unit), 255)]).astype(np.uint8)
+
+# Build a sphere with spherical UVs and a generated checker texture
+def textured_sphere(subdivisions, radius, texture_size):
+    from PIL import Image
+    mesh = trimesh.creation.icosphere(subdivisions=subdivisions, radius=radius)
+    x, y, z = mesh.vertices.T / radius
+    uv = np.column_stack([np.arctan2(y, x) / (2 * np.pi) + 0.5, np.arccos(np.clip(z, -1, 1)) / np.pi])
+    v, u = np.mgrid[0:texture_size, 0:texture_size] * 255 // texture_size
+    checker = ((u // 32 + v // 32) % 2) * 255
+    image = np.stack([u, v, checker, np.full_like(u, 255)], axis=-1).astype(np.uint8)
+    mesh.visual = trimesh.visual.TextureVisuals(uv=uv, image=Image.fromarray(image))
+    return mesh
+
+# Generate the synthetic models of the given sizes, returns a list of (name, file path)
+def generate_models(directory, sizes):
+    models = []
+    for size in sizes:
+        subdivisions, radius, box_subdivisions, texture_size = SIZES[size]
+        sphere = trimesh.creation.icosphere(subdivisions=subdivisions, radius=radius)
+        sphere.visual.vertex_colors = gradient_colors(sphere)
+        models.append((f'sphere_{size}', sphere, 'ply'))
+
+        box = trimesh.creation.box(extents=(radius * 2, radius, radius * 1.5))
+        for _ in range(box_subdivisions):
+            box = box.subdivide()
+        box.visual.vertex_colors = gradient_colors(box)
+        models.append((f'box_{size}', box, 'ply'))
+
+        try:
+            models.append((f'textured_{size}', textured_sphere(subdivisions - 1, radius, texture_size), 'glb'))
+        except ImportError:
+            print(f"Pillow is not installed, skipping textured_{size}")
+
+    files = []
+    for name, mesh, extension in models:
+        path = os.path.join(directory, f'{name}.{extension}')
+        mesh.export(path)
+        files.append((name, path))
+    return files
+
+# Run every stage of one conversion, returns the timings in seconds and counters
+def run_case(model_file, world_path, pitch, game_version=tran.GAME_VERSION):
+    create_flat_world(world_path, game_version)
+    profiler = tran.Profiler()
+    tran._profiler.current = profiler
+    block_table = tran.get_block_table()
+    timings = {}
+
+    start_time = time.perf_counter()
+    meshes = tran.load_model(model_file)
+    timings['load_model'] = time.perf_counter() - start_time
+    world = load_level(world_path)
+
+    timings['voxelize_model'] = timings['insert_blocks'] = 0.0
+    voxels = blocks = 0
+    for mesh, transforms in meshes:
+        start_time = time.perf_counter()
+        points, voxel_colors = tran.voxelize_model(mesh, tran.get_instance_pitch(transforms, pitch), use_cache=False)
+        timings['voxelize_model'] += time.perf_counter() - start_time
+        voxels += len(points)
+
+        start_time = time.perf_counter()
+        blocks += tran.insert_blocks(points, voxel_colors, world, block_table, BENCH_START_POS, tran.ROTATE_ANGLE, pitch, game_version, transforms=transforms)
+        timings['insert_blocks'] += time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    world.save()
+    timings['world_save'] = time.perf_counter() - start_time
+    world.close()
+    return timings, profiler.stages, {'voxels': voxels, 'blocks': blocks, 'chunks': len(profiler.touched_chunks)}
+
+# Time fresh interpreters starting the tools, which is dominated by imports
+STARTUP_COMMANDS = {
+    'mcify_help': ['mcify.py', '--help'],
+    'import_gui': ['-c', 'import gui'],
+    'warm_up': ['-c', 'import tran; tran.warm_up()'],
+}
+def measure_startup(repeat=1):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    timings = {}
+    for name, command in STARTUP_COMMANDS.items():
+        runs = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            subprocess.run([sys.executable] + command, cwd=directory, capture_output=True, check=True)
+            runs.append(time.perf_counter() - start_time)
+        timings[name] = min(runs)
+    return timings
+
+# Describe the environment, so results of different machines and commits can be told apart
+def get_environment():
+    import amulet
+    import scipy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'trimesh': trimesh.__version__,
+        'amulet': getattr(amulet, '__version__', ''),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the conversion pipeline on synthetic models | 使用合成模型测试转换流程性能')
+    parser.add_argument('--pitches', default='1.0,0.5',
+                       help='comma separated pitches to sweep | 逗号分隔的体素大小列表')
+    parser.add_argument('--sizes', default='small,medium',
+                       help=f'comma separated model sizes from {",".join(SIZES)} | 逗号分隔的模型规模')
+    parser.add_argument('--repeat', type=int, default=1,
+                       help='runs per case, the fastest run of each stage is kept | 每项运行次数，各阶段取最快一次')
+    parser.add_argument('--output', default='benchmark.json',
+                       help='JSON results path | JSON 结果文件路径')
+    args = parser.parse_args()
+    pitches = [float(pitch) for pitch in args.pitches.split(',')]
+    sizes = args.sizes.split(',')
+
+    results = {'environment': get_environment(), 'startup': measure_startup(args.repeat), 'cases': []}
+    tran.warm_up()
+    directory = tempfile.mkdtemp(prefix='mcify_bench_')
+    try:
+        models = generate_models(directory, sizes)
+        for name, model_file in models:
+            for pitch in pitches:
+                runs = [run_case(model_file, os.path.join(directory, 'world'), pitch) for _ in range(args.repeat)]
+                timings = {stage: min(run[0][stage] for run in runs) for stage in runs[0][0]}
+                stages = {stage: min(run[1].get(stage, 0.0) for run in runs) for stage in runs[0][1]}
+                results['cases'].append({'model': name, 'pitch': pitch, 'timings': timings, 'stages': stages, 'counters': runs[0][2]})
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    results['environment']['peak_memory'] = tran.get_peak_memory()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('-'*20)
+    print('Startup: ' + ', '.join(f'{name} {seconds:.2f}s' for name, seconds in results['startup'].items()))
+    print(f"{'model':<20}{'pitch':>7}{'voxels':>10}{'load':>9}{'voxelize':>10}{'insert':>9}{'save':>9}")
+    for case in results['cases']:
+        timings = case['timings']
+        print(f"{case['model']:<20}{case['pitch']:>7}{case['counters']['voxels']:>10}{timings['load_model']:>9.2f}{timings['voxelize_model']:>10.2f}{timings['insert_blocks']:>9.2f}{timings['world_save']:>9.2f}")
+    print(f"Results saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
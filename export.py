@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import numpy as np
+from amulet_nbt import NamedTag, CompoundTag, ListTag, StringTag, IntTag, ShortTag, LongTag, ByteArrayTag, IntArrayTag, LongArrayTag
+
+OUTPUT_FORMATS = ('world', 'schem', 'nbt', 'litematic', 'datapack')
+AIR = "minecraft:air"
+FILL_CELL = 32  # Boxes are merged inside 32x32x32 cells, so a /fill never exceeds the 32768 block limit
+COMMANDS_PER_FUNCTION = 10000  # Commands per .mcfunction file, each file runs in its own tick
+DATAPACK_NAMESPACE = "minecraftify"
+LOAD_WAIT = 5  # Ticks between forceloading the chunks of a part and checking or filling them
+# Datapack pack_format by the first game version using it
+PACK_FORMATS = [((1, 13, 0), 4), ((1, 15, 0), 5), ((1, 16, 2), 6), ((1, 17, 0), 7), ((1, 18, 0), 8), ((1, 18, 2), 9),
+                ((1, 19, 0), 10), ((1, 19, 4), 12), ((1, 20, 0), 15), ((1, 20, 2), 18), ((1, 20, 3), 26), ((1, 20, 5), 41), ((1, 21, 0), 48)]
+
+# Get the data version of a game version, the translation manager is loaded on first use
+_translation_manager = None
+def get_data_version(game_version):
+    global _translation_manager
+    if _translation_manager is None:
+        import PyMCTranslate
+        _translation_manager = PyMCTranslate.new_translation_manager()
+    return _translation_manager.get_version(*game_version).data_version
+
+# Get the voxel positions relative to the minimum corner, the structure size and the palette with air at index 0
+def get_structure_layout(model):
+    if len(model) == 0:
+        return np.zeros((0, 3), dtype=np.int64), (1, 1, 1), [AIR], np.zeros(0, dtype=np.int64)
+    min_corner, max_corner = model.bounds()
+    positions = model.coords.astype(np.int64) - min_corner
+    size = tuple(int(v) for v in max_corner - min_corner + 1)
+    used = np.unique(model.block_indices)
+    palette_map = np.zeros(len(model.block_names), dtype=np.int64)
+    palette_map[used] = np.arange(1, len(used) + 1)
+    palette = [AIR] + [model.block_names[i] for i in used]
+    return positions, size, palette, palette_map[model.block_indices]
+
+# Encode non-negative integers as a varint byte stream
+def encode_varints(values):
+    values = np.asarray(values, dtype=np.int64)
+    byte_num = np.ones(len(values), dtype=np.int64)
+    while (values >> (7 * byte_num)).any():
+        byte_num += (values >> (7 * byte_num)) > 0
+    offsets = np.concatenate(([0], np.cumsum(byte_num)[:-1]))
+    data = np.zeros(int(byte_num.sum()), dtype=np.uint8)
+    for i in range(int(byte_num.max(initial=1))):
+        mask = byte_num > i
+        data[offsets[mask] + i] = ((values[mask] >> (7 * i)) & 0x7F) | np.where(byte_num[mask] > i + 1, 0x80, 0)
+    return data
+
+# Export a Sponge schematic (version 2), blocks are stored as varints in x, z, y order
+def export_schem(model, path, game_version):
+    positions, (width, height, length), palette, states = get_structure_layout(model)
+    block_data = np.zeros(width * height * length, dtype=np.int64)
+    block_data[positions[:, 0] + positions[:, 2] * width + positions[:, 1] * width * length] = states
+    schematic = CompoundTag({
+        "Version": IntTag(2),
+        "DataVersion": IntTag(get_data_version(game_version)),
+        "Width": ShortTag(width),
+        "Height": ShortTag(height),
+        "Length": ShortTag(length),
+        "Offset": IntArrayTag([0, 0, 0]),
+        "PaletteMax": IntTag(len(palette)),
+        "Palette": CompoundTag({name: IntTag(i) for i, name in enumerate(palette)}),
+        "BlockData": ByteArrayTag(encode_varints(block_data).view(np.int8)),
+        "BlockEntities": ListTag([], 10),
+    })
+    NamedTag(schematic, "Schematic").save_to(path)
+
+# Export a vanilla structure file, only non-air blocks are listed so empty cells keep the existing blocks
+def export_structure_nbt(model, path, game_version):
+    positions, size, palette, states = get_structure_layout(model)
+    if max(size) > 48:
+        print(f"Warning: structure size {size} exceeds the 48 block limit of structure blocks")
+    blocks = ListTag([
+        CompoundTag({"pos": ListTag([IntTag(x), IntTag(y), IntTag(z)]), "state": IntTag(state)})
+        for (x, y, z), state in zip(positions.tolist(), states.tolist())
+    ], 10)
+    structure = CompoundTag({
+        "DataVersion": IntTag(get_data_version(game_version)),
+        "size": ListTag([IntTag(v) for v in size]),
+        "palette": ListTag([CompoundTag({"Name": StringTag(name)}) for name in palette], 10),
+        "blocks": blocks,
+        "entities": ListTag([], 10),
+    })
+    NamedTag(structure, "").save_to(path)
+
+# Pack block states into longs with entries spanning long boundaries, as Litematica does
+def pack_block_states(indices, states, volume, bits):
+    words = np.zeros((volume * bits + 63) // 64, dtype=np.uint64)
+    start = np.asarray(indices, dtype=np.uint64) * np.uint64(bits)
+    word, offset = start // np.uint64(64), start % np.uint64(64)
+    values = np.asarray(states, dtype=np.uint64)
+    np.bitwise_or.at(words, word, values << offset)
+    spans = offset + np.uint64(bits) > np.uint64(64)
+    np.bitwise_or.at(words, word[spans] + np.uint64(1), values[spans] >> (np.uint64(64) - offset[spans]))
+    return words.view(np.int64)
+
+# Export a Litematica schematic with a single region
+def export_litematic(model, path, game_version, name="Minecraftify"):
+    positions, (width, height, length), palette, states = get_structure_layout(model)
+    volume = width * height * length
+    bits = max(2, int(np.ceil(np.log2(len(palette)))))
+    indices = (positions[:, 1] * length + positions[:, 2]) * width + positions[:, 0]
+    now = LongTag(int(time.time() * 1000))
+    size = CompoundTag({"x": IntTag(width), "y": IntTag(height), "z": IntTag(length)})
+    region = CompoundTag({
+        "Position": CompoundTag({"x": IntTag(0), "y": IntTag(0), "z": IntTag(0)}),
+        "Size": size,
+        "BlockStatePalette": ListTag([CompoundTag({"Name": StringTag(block_name)}) for block_name in palette], 10),
+        "BlockStates": LongArrayTag(pack_block_states(indices, states, volume, bits)),
+        "TileEntities": ListTag([], 10),
+        "Entities": ListTag([], 10),
+        "PendingBlockTicks": ListTag([], 10),
+        "PendingFluidTicks": ListTag([], 10),
+    })
+    litematic = CompoundTag({
+        "MinecraftDataVersion": IntTag(get_data_version(game_version)),
+        "Version": IntTag(6),
+        "Metadata": CompoundTag({
+            "Name": StringTag(name),
+            "Author": StringTag("Minecraftify"),
+            "Description": StringTag(""),
+            "RegionCount": IntTag(1),
+            "TotalBlocks": IntTag(len(model)),
+            "TotalVolume": IntTag(volume),
+            "EnclosingSize": size,
+            "TimeCreated": now,
+            "TimeModified": now,
+        }),
+        "Regions": CompoundTag({name: region}),
+    })
+    NamedTag(litematic, "").save_to(path)
+
+# Greedily merge same-block voxels of one cell into boxes, grid is indexed [y, z, x] with block index + 1 and 0 for empty
+def merge_cell_boxes(grid):
+    boxes = []
+    for y, z, x in np.argwhere(grid):
+        block = grid[y, z, x]
+        if block == 0:
+            continue
+        # Extend along x, then z, then y while the whole face matches
+        row = grid[y, z, x:] == block
+        x1 = x + (len(row) if row.all() else int(np.argmin(row))) - 1
+        z1 = z
+        while z1 + 1 < grid.shape[1] and (grid[y, z1 + 1, x:x1 + 1] == block).all():
+            z1 += 1
+        y1 = y
+        while y1 + 1 < grid.shape[0] and (grid[y1 + 1, z:z1 + 1, x:x1 + 1] == block).all():
+            y1 += 1
+        grid[y:y1 + 1, z:z1 + 1, x:x1 + 1] = 0
+        boxes.append((x, y, z, x1, y1, z1, block - 1))
+    return boxes
+
+# Merge a voxel model into boxes of (x0, y0, z0, x1, y1, z1, block index) in world coordinates, cell by cell in chunk order
+def merge_boxes(model):
+    if len(model) == 0:
+        return np.zeros((0, 7), dtype=np.int64)
+    coords = model.coords.astype(np.int64)
+    cells = coords // FILL_CELL
+    order = np.lexsort((cells[:, 1], cells[:, 2], cells[:, 0]))
+    coords, cells, block_indices = coords[order], cells[order], model.block_indices[order]
+    bounds = np.flatnonzero((cells[1:] != cells[:-1]).any(axis=1)) + 1
+    boxes = []
+    for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(coords)]))):
+        origin = cells[start] * FILL_CELL
+        local = coords[start:end] - origin
+        grid = np.zeros((FILL_CELL, FILL_CELL, FILL_CELL), dtype=np.int16)
+        grid[local[:, 1], local[:, 2], local[:, 0]] = block_indices[start:end].astype(np.int16) + 1
+        cell_boxes = np.array(merge_cell_boxes(grid), dtype=np.int64).reshape(-1, 7)
+        cell_boxes[:, :6] += np.tile(origin, 2)
+        boxes.append(cell_boxes)
+    return np.concatenate(boxes)
+
+# Get the datapack pack_format of a game version
+def get_pack_format(game_version):
+    pack_format = PACK_FORMATS[0][1]
+    for version, version_format in PACK_FORMATS:
+        if tuple(game_version[1]) >= version:
+            pack_format = version_format
+    return pack_format
+
+# Export a datapack of /fill commands, run it in game with /function minecraftify:build
+# Each part forceloads its 32x32 columns, waits for them to load, fills them and then starts the next part.
+# From 1.19.4 the wait checks the chunks with "execute if loaded" and retries until they are all loaded,
+# older versions can't check and wait a fixed time
+def export_datapack(model, path, game_version):
+    boxes = merge_boxes(model)
+    print(f"Merged {len(model)} blocks into {len(boxes)} commands, {len(model) - len(boxes)} commands saved")
+    folder = 'function' if tuple(game_version[1]) >= (1, 21, 0) else 'functions'
+    function_dir = os.path.join(path, 'data', DATAPACK_NAMESPACE, folder)
+    os.makedirs(function_dir, exist_ok=True)
+    with open(os.path.join(path, 'pack.mcmeta'), 'w') as f:
+        json.dump({"pack": {"pack_format": get_pack_format(game_version), "description": "Built by Minecraftify"}}, f, indent=2)
+
+    check_loaded = tuple(game_version[1]) >= (1, 19, 4)
+
+    # Split the commands into parts at column boundaries
+    columns = boxes[:, [0, 2]] // FILL_CELL
+    column_starts = np.concatenate(([0], np.flatnonzero((columns[1:] != columns[:-1]).any(axis=1)) + 1, [len(boxes)]))
+    parts, part_start = [], 0
+    for column_start, column_end in zip(column_starts[:-1], column_starts[1:]):
+        if column_end - part_start > COMMANDS_PER_FUNCTION and column_start > part_start:
+            parts.append((part_start, column_start))
+            part_start = column_start
+    parts.append((part_start, len(boxes)))
+
+    for n, (start, end) in enumerate(parts):
+        part_columns = np.unique(columns[start:end], axis=0) * FILL_CELL
+        forceload = [f"{x} {z} {x + FILL_CELL - 1} {z + FILL_CELL - 1}" for x, z in part_columns.tolist()]
+        with open(os.path.join(function_dir, f'load_{n}.mcfunction'), 'w') as f:
+            f.writelines(f"forceload add {area}\n" for area in forceload)
+            f.write(f"schedule function {DATAPACK_NAMESPACE}:{'wait' if check_loaded else 'fill'}_{n} {LOAD_WAIT}t\n")
+        if check_loaded:
+            # Fill once every chunk of the part is loaded, otherwise check again later
+            with open(os.path.join(function_dir, f'wait_{n}.mcfunction'), 'w') as f:
+                f.write(f"scoreboard players set #loaded {DATAPACK_NAMESPACE} 1\n")
+                f.writelines(f"execute unless loaded {x + dx} 0 {z + dz} run scoreboard players set #loaded {DATAPACK_NAMESPACE} 0\n"
+                             for x, z in part_columns.tolist() for dx in range(0, FILL_CELL, 16) for dz in range(0, FILL_CELL, 16))
+                f.write(f"execute if score #loaded {DATAPACK_NAMESPACE} matches 1 run function {DATAPACK_NAMESPACE}:fill_{n}\n")
+                f.write(f"execute if score #loaded {DATAPACK_NAMESPACE} matches 0 run schedule function {DATAPACK_NAMESPACE}:wait_{n} {LOAD_WAIT}t\n")
+        with open(os.path.join(function_dir, f'fill_{n}.mcfunction'), 'w') as f:
+            for x0, y0, z0, x1, y1, z1, block in boxes[start:end].tolist():
+                if (x0, y0, z0) == (x1, y1, z1):
+                    f.write(f"setblock {x0} {y0} {z0} {model.block_names[block]}\n")
+                else:
+                    f.write(f"fill {x0} {y0} {z0} {x1} {y1} {z1} {model.block_names[block]}\n")
+            f.writelines(f"forceload remove {area}\n" for area in forceload)
+            if n + 1 < len(parts):
+                f.write(f"function {DATAPACK_NAMESPACE}:load_{n + 1}\n")
+            else:
+                f.write('tellraw @a "Minecraftify: build finished"\n')
+    with open(os.path.join(function_dir, 'build.mcfunction'), 'w') as f:
+        if check_loaded:
+            f.write(f"scoreboard objectives add {DATAPACK_NAMESPACE} dummy\n")
+        f.write(f"function {DATAPACK_NAMESPACE}:load_0\n")
+    print(f"Datapack written with {len(parts)} parts, run /function {DATAPACK_NAMESPACE}:build in game")
+    if not check_loaded:
+        print(f"Note: versions before 1.19.4 can't check whether chunks are loaded, each part is filled {LOAD_WAIT} ticks after "
+              "forceloading its chunks. Blocks in chunks that are not generated or loaded by then are missing, run the build again near them")
+
+# Export a voxel model to a structure file or datapack of the given format
+def export_model(model, path, output_format, game_version):
+    print(f"Exporting {len(model)} blocks to {path}...")
+    if output_format == 'schem':
+        export_schem(model, path, game_version)
+    elif output_format == 'nbt':
+        export_structure_nbt(model, path, game_version)
+    elif output_format == 'litematic':
+        export_litematic(model, path, game_version)
+    elif output_format == 'datapack':
+        export_datapack(model, path, game_version)
+    else:
+        raise ValueError(f"Unsupported output format: {output_format}")
@@ -2,11 +2,20 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import json
 import os
-from tran import model_to_minecraft
-import threading
+from tran import model_to_minecraft, warm_up, Profiler, CACHE_DIR
+import multiprocessing
+import queue
+import time
+from collections import deque
+from contextlib import contextmanager
 from io import StringIO
 import sys
 
+POLL_INTERVAL = 50  # Milliseconds between two drains of the event queue
+PROGRESS_INTERVAL = 0.1  # Minimum seconds between two progress events
+CANCEL_TIMEOUT = 2.0  # Seconds to wait for a cancelled conversion to stop by itself before terminating it
+PREVIEW_FILE = os.path.join(CACHE_DIR, 'preview.png')
+
 # Language settings
 LANGUAGES = {
     'en': {
@@ -23,6 +32,8 @@ LANGUAGES = {
         'start_pos': 'Start Position (x, y, z)',
         'rotate_angle': 'Rotate Angle (rx, ry, rz)',
         'pitch': 'Pitch',
+        'max_blocks': 'Max Blocks (0 = use pitch)',
+        'target_size': 'Target Size in Blocks (0 = use pitch)',
         'game_version': 'Game Version (e.g., 1.20.1)',
         'convert': 'Convert',
         'language': 'Language',
@@ -31,6 +42,11 @@ LANGUAGES = {
         'error_no_file': 'Please select model file and world path',
         'convert_success': 'The conversion was successful! Enjoy your Minecraft model!',
         'convert_failed': 'Conversion failed',
+        'cancel': 'Cancel',
+        'preview': 'Preview',
+        'preview_title': 'Preview: top, isometric / front, side',
+        'convert_cancelled': 'Conversion cancelled',
+        'convert_queued': 'Conversion queued, {} waiting',
         'output_msg': 'Output Message'
     },
     'zh': {
@@ -47,6 +63,8 @@ LANGUAGES = {
         'start_pos': '起始位置 (x, y, z)',
         'rotate_angle': '旋转角度 (rx, ry, rz)',
         'pitch': '体素大小',
+        'max_blocks': '最大方块数 (0 = 使用体素大小)',
+        'target_size': '目标尺寸/方块 (0 = 使用体素大小)',
         'game_version': '游戏版本 (如：1.20.1)',
         'convert': '转换',
         'language': '语言',
@@ -55,19 +73,103 @@ LANGUAGES = {
         'error_no_file': '未选择模型文件或世界路径',
         'convert_success': '转换成功！享受你的Minecraft模型！',
         'convert_failed': '转换失败',
+        'cancel': '取消',
+        'preview': '预览',
+        'preview_title': '预览：俯视、等轴测 / 正视、侧视',
+        'convert_cancelled': '转换已取消',
+        'convert_queued': '转换已加入队列，{} 个等待中',
         'output_msg': '输出信息'
     }
 }
 
+class ConversionCancelled(Exception):
+    pass
+
+# Channel of ('log' | 'progress' | 'done' | 'error' | 'cancelled', value) events from a conversion process,
+# drained by the Tk main loop, along with the flags shared between both processes
+class EventChannel:
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.events = multiprocessing.Queue()
+        self.options = multiprocessing.Queue()
+        self.cancelled = multiprocessing.Event()
+        self.saving = multiprocessing.Event()
+        self.interval = interval
+        self.last_progress = 0.0
+
+    def put(self, kind, value=None):
+        self.events.put((kind, value))
+
+    # Progress callback for model_to_minecraft, coalesced to at most one event per interval.
+    # Stops the conversion once cancelled, which is before the world is saved
+    def call_back(self, stage_index, stage_num, current_step, stage_steps):
+        if self.cancelled.is_set():
+            raise ConversionCancelled()
+        now = time.perf_counter()
+        if now - self.last_progress < self.interval:
+            return
+        self.last_progress = now
+        self.put('progress', (stage_index + current_step / stage_steps) / stage_num * 100)
+
+    # Take every pending event, merging the logs and keeping only the latest progress
+    def drain(self):
+        logs, progress, results = [], None, []
+        while True:
+            try:
+                kind, value = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'log':
+                logs.append(value)
+            elif kind == 'progress':
+                progress = value
+            else:
+                results.append((kind, value))
+        return ''.join(logs), progress, results
+
 class StdoutRedirector(StringIO):
-    def __init__(self, text_widget):
+    def __init__(self, channel):
         super().__init__()
-        self.text_widget = text_widget
+        self.channel = channel
 
     def write(self, string):
-        self.text_widget.insert(tk.END, string)
-        self.text_widget.see(tk.END)
-        self.text_widget.update_idletasks() 
+        self.channel.put('log', string)
+        return len(string)
+
+# Profiler flagging the world save, during which a conversion must not be terminated
+class SaveAwareProfiler(Profiler):
+    def __init__(self, saving):
+        super().__init__()
+        self.saving = saving
+
+    @contextmanager
+    def stage(self, name):
+        if name != 'world_save':
+            with super().stage(name):
+                yield
+            return
+        self.saving.set()
+        try:
+            with super().stage(name):
+                yield
+        finally:
+            self.saving.clear()
+
+# Entry point of the conversion process, which imports the heavy modules while waiting for its first options.
+# Conversions then run one after another in it, keeping the block tables, translated blocks and lookup tables warm
+def run_conversions(channel):
+    sys.stdout = StdoutRedirector(channel)
+    warm_up()
+    while True:
+        options = channel.options.get()
+        if options is None:
+            return
+        try:
+            model_to_minecraft(**options, call_back=channel.call_back, profiler=SaveAwareProfiler(channel.saving))
+            channel.put('done')
+        except ConversionCancelled:
+            channel.put('cancelled')
+        except Exception as e:
+            channel.put('error', str(e))
 
 class App(tk.Tk):
     def __init__(self):
@@ -79,6 +181,16 @@ class App(tk.Tk):
         self.geometry('800x700')
         self.minsize(800, 700)
         self.create_widgets()
+        self.jobs = deque()
+        self.process = None
+        self.channel = None
+        self.cancel_time = None
+        self.failures = []
+        self.job = None
+        self.preview_window = None
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.poll_events()
+        self.after_idle(self.prepare_worker)
 
     def load_language(self):
         if os.path.exists('settings.json'):
@@ -201,7 +313,9 @@ class App(tk.Tk):
             (LANGUAGES[self.language]['start_pos'], '(0, -60, 0)'),
             (LANGUAGES[self.language]['rotate_angle'], '(0, 0, 0)'),
             (LANGUAGES[self.language]['pitch'], '1.0'),
-            (LANGUAGES[self.language]['game_version'], '1.20.1')
+            (LANGUAGES[self.language]['game_version'], '1.20.1'),
+            (LANGUAGES[self.language]['max_blocks'], '0'),
+            (LANGUAGES[self.language]['target_size'], '0')
         ]
         
         for i, (label_text, default_value) in enumerate(options):
@@ -228,9 +342,12 @@ class App(tk.Tk):
         self.language_combo.bind('<<ComboboxSelected>>', self.change_language)
         self.language_combo.pack(side=tk.LEFT, padx=5)
 
-        # Convert button
-        convert_button = ttk.Button(main_frame, text=LANGUAGES[self.language]['convert'], command=self.convert)
-        convert_button.pack(pady=20)
+        # Preview, convert and cancel buttons
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(pady=20)
+        ttk.Button(button_frame, text=LANGUAGES[self.language]['preview'], command=self.preview).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text=LANGUAGES[self.language]['convert'], command=self.convert).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text=LANGUAGES[self.language]['cancel'], command=self.cancel).pack(side=tk.LEFT, padx=5)
 
         # Progress bar
         self.progress = ttk.Progressbar(main_frame, orient='horizontal', length=400, mode='determinate')
@@ -263,55 +380,156 @@ class App(tk.Tk):
     def change_language(self, event):
         self.language = self.language_combo.get()
         self.save_language()
+        self.stop_worker()
         self.destroy()
         App().mainloop()
 
-    def convert(self):
+    # Read the conversion options from the widgets, returns None after showing the error of invalid options
+    def get_options(self, need_world=True):
         obj_file = self.obj_file_entry.get()
         world_path = self.world_path_entry.get()
-        if not obj_file or not world_path:
+        if not obj_file or (need_world and not world_path):
             messagebox.showerror(LANGUAGES[self.language]['title'], LANGUAGES[self.language]['error_no_file'])
-            return
+            return None
 
-        def convert_thread():
-            old_stdout = sys.stdout
-            sys.stdout = StdoutRedirector(self.output_text)
-            try:
-                start_pos = eval(self.option_entry_0.get())
-                rotate_angle = eval(self.option_entry_1.get())
-                pitch = float(self.option_entry_2.get())
-                game_version = ('java', tuple(map(int, self.option_entry_3.get().split('.'))))
-                wool = bool(self.wool_var.get())
-                concrete = bool(self.concrete_var.get())
-                terracotta = bool(self.terracotta_var.get())
-                glass = bool(self.glass_var.get())
-
-                def call_back(stage_index, stage_num, current_step, stage_steps):
-                    progress_percent = (stage_index + current_step / stage_steps) / stage_num * 100
-                    self.progress['value'] = progress_percent
-                    self.update_idletasks()
-
-                model_to_minecraft(
-                    obj_file=obj_file,
-                    world_path=world_path,
-                    start_pos=start_pos,
-                    rotate_angle=rotate_angle,
-                    pitch=pitch,
-                    game_version=game_version,
-                    wool=wool,
-                    concrete=concrete,
-                    terracotta=terracotta,
-                    glass=glass,
-                    call_back=call_back
-                )
-                messagebox.showinfo(LANGUAGES[self.language]['title'], LANGUAGES[self.language]['convert_success'])
-            except Exception as e:
-                messagebox.showerror(LANGUAGES[self.language]['title'], LANGUAGES[self.language]['convert_failed']+f': {str(e)}')
-            finally:
-                sys.stdout = old_stdout
-                self.progress['value'] = 0
-
-        threading.Thread(target=convert_thread).start()
+        try:
+            options = {
+                'obj_file': obj_file,
+                'world_path': world_path,
+                'start_pos': eval(self.option_entry_0.get()),
+                'rotate_angle': eval(self.option_entry_1.get()),
+                'pitch': float(self.option_entry_2.get()),
+                'game_version': ('java', tuple(map(int, self.option_entry_3.get().split('.')))),
+                'max_blocks': int(self.option_entry_4.get()),
+                'target_size': float(self.option_entry_5.get()),
+                'wool': bool(self.wool_var.get()),
+                'concrete': bool(self.concrete_var.get()),
+                'terracotta': bool(self.terracotta_var.get()),
+                'glass': bool(self.glass_var.get()),
+            }
+        except Exception as e:
+            messagebox.showerror(LANGUAGES[self.language]['title'], LANGUAGES[self.language]['convert_failed']+f': {str(e)}')
+            return None
+        return options
+
+    def convert(self):
+        options = self.get_options()
+        if options is not None:
+            self.queue_job(options)
+
+    # Render the model at a coarse pitch instead of writing it, the views are shown once rendered
+    def preview(self):
+        options = self.get_options(need_world=False)
+        if options is not None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            options['preview'] = PREVIEW_FILE
+            self.queue_job(options)
+
+    def queue_job(self, options):
+        self.jobs.append(options)
+        if self.job is None:
+            self.start_next_job()
+        else:
+            self.log(LANGUAGES[self.language]['convert_queued'].format(len(self.jobs)) + '\n')
+
+    # Run the next queued conversion in the conversion process, so it neither blocks Tk nor shares the GIL with it
+    def start_next_job(self):
+        if self.process is not None and not self.process.is_alive():
+            self.process = self.channel = None
+        self.prepare_worker()
+        self.cancel_time = None
+        self.job = self.jobs.popleft()
+        self.channel.cancelled.clear()
+        self.channel.options.put(self.job)
+
+    # Start the conversion process ahead of time, so its imports are done by the time a conversion is queued.
+    # It lives until it has to be terminated, then the next one is started
+    def prepare_worker(self):
+        if self.process is None:
+            self.channel = EventChannel()
+            self.process = multiprocessing.Process(target=run_conversions, args=(self.channel,))
+            self.process.start()
+
+    # Stop the conversion process, waiting for a world save in progress to finish
+    def stop_worker(self):
+        if self.process is not None:
+            self.channel.cancelled.set()
+            if self.channel.saving.is_set():
+                self.channel.options.put(None)
+                self.process.join()
+            else:
+                self.process.terminate()
+            self.process = self.channel = None
+
+    # Stop the running conversion. Nothing has been saved unless the world is being saved, which is waited for
+    def cancel(self):
+        if self.job is not None and self.cancel_time is None:
+            self.channel.cancelled.set()
+            self.cancel_time = time.perf_counter()
+
+    def close(self):
+        self.jobs.clear()
+        self.stop_worker()
+        self.destroy()
+
+    def log(self, string):
+        self.output_text.insert(tk.END, string)
+        self.output_text.see(tk.END)
+
+    # Apply the events of the conversion process to the widgets, runs on the Tk main loop only
+    def poll_events(self):
+        if self.job is not None:
+            alive = self.process.is_alive()
+            logs, progress, results = self.channel.drain()
+            if logs:
+                self.log(logs)
+            if progress is not None:
+                self.progress['value'] = progress
+            if not results and alive and self.cancel_time is not None and not self.channel.saving.is_set() \
+                    and time.perf_counter() - self.cancel_time > CANCEL_TIMEOUT:
+                # The conversion is busy in a step without progress callbacks, the world is untouched until saved
+                self.process.terminate()
+                self.process.join(CANCEL_TIMEOUT)
+                self.process = self.channel = None
+                results = [('cancelled', None)]
+            elif not results and not alive:
+                results = [('error', f'exit code {self.process.exitcode}')]
+                self.process = self.channel = None
+            if results:
+                self.finish_job(*results[-1])
+        self.after(POLL_INTERVAL, self.poll_events)
+
+    def finish_job(self, kind, value):
+        self.progress['value'] = 0
+        preview = self.job.get('preview')
+        self.job = None
+        if kind == 'cancelled':
+            self.log(LANGUAGES[self.language]['convert_cancelled'] + '\n')
+        elif kind == 'error':
+            self.log(LANGUAGES[self.language]['convert_failed'] + f': {value}\n')
+            self.failures.append(value)
+        elif preview:
+            self.show_preview(preview)
+        if self.jobs:
+            self.start_next_job()
+        elif self.failures:
+            messagebox.showerror(LANGUAGES[self.language]['title'], LANGUAGES[self.language]['convert_failed']+f': {self.failures[-1]}')
+            self.failures = []
+        elif kind == 'done' and not preview:
+            messagebox.showinfo(LANGUAGES[self.language]['title'], LANGUAGES[self.language]['convert_success'])
+        if self.job is None:
+            self.prepare_worker()
+
+    # Show a rendered preview, reusing the preview window while it is open
+    def show_preview(self, path):
+        if self.preview_window is None or not self.preview_window.winfo_exists():
+            self.preview_window = tk.Toplevel(self)
+            self.preview_window.title(LANGUAGES[self.language]['preview_title'])
+            self.preview_label = ttk.Label(self.preview_window)
+            self.preview_label.pack()
+        self.preview_image = tk.PhotoImage(file=path)
+        self.preview_label.configure(image=self.preview_image)
+        self.preview_window.lift()
 
     def toggle_advanced(self, content):
         if self.advanced_expanded.get():
@@ -321,5 +539,6 @@ class App(tk.Tk):
         self.advanced_expanded.set(not self.advanced_expanded.get())
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     app = App()
     app.mainloop()
\ No newline at end of file
@@ -1,6 +1,13 @@
 import argparse
-from tran import model_to_minecraft, START_POS, ROTATE_ANGLE, PITCH, GAME_VERSION
+import multiprocessing
+import os
+import sys
+from tran import model_to_minecraft, batch_to_minecraft, rollback, list_backups, Profiler, START_POS, ROTATE_ANGLE, PITCH, GAME_VERSION, TILE_SIZE, WORKERS, SAVE_INTERVAL, SAMPLER, SAMPLERS, POINT_REDUCTION, POINT_REDUCTIONS
+from export import OUTPUT_FORMATS
 # example: python mcify.py model.obj world_path --start-pos 10,20,30 --rotate 45,0,0 --pitch 0.5 --version 1.20.1 --no-wool --no-glass
+# batch example: python mcify.py manifest.json world_path --batch --workers 0
+# rollback example: python mcify.py rollback world_path
+# server example: python mcify.py serve, then python mcify.py model.obj world_path --server 127.0.0.1:8765
 
 def parse_tuple(tuple_str):
     try:
@@ -16,12 +23,46 @@ def parse_version(ver_str):
     except:
         raise argparse.ArgumentTypeError("--version must be in the format major.minor.patch")
 
+# Restore the chunks backed up before a conversion
+def rollback_main(argv):
+    parser = argparse.ArgumentParser(prog='mcify.py rollback', description='Undo a conversion by restoring the chunks backed up before it | 恢复转换前备份的区块以撤销转换')
+    parser.add_argument('world_path', help='Minecraft world path | Minecraft 世界路径')
+    parser.add_argument('--backup', help='backup file to restore, the latest one by default | 要恢复的备份文件，默认为最新的备份')
+    parser.add_argument('--list', action='store_true', help='list the backups of the world | 列出世界的备份')
+    args = parser.parse_args(argv)
+    if args.list:
+        for backup_file in list_backups(args.world_path):
+            print(backup_file)
+    else:
+        rollback(args.world_path, args.backup)
+
+# Keep a conversion server running, which accepts jobs over a local HTTP API
+def serve_main(argv):
+    from server import serve, HOST, PORT
+    parser = argparse.ArgumentParser(prog='mcify.py serve', description='Run a conversion server keeping worlds open and caches warm between jobs | 运行转换服务器，在任务之间保持世界打开和缓存预热')
+    parser.add_argument('--host', default=HOST, help='address to listen on | 监听地址')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on | 监听端口')
+    parser.add_argument('--token', help='token clients must send, a random one is printed by default | 客户端需要发送的令牌，默认生成并输出随机令牌')
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.token)
+
+def parse_address(address_str):
+    try:
+        host, port = address_str.rsplit(':', 1)
+        return host, int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError("--server must be in the format host:port")
+
 def main():
+    if sys.argv[1:2] == ['rollback']:
+        return rollback_main(sys.argv[2:])
+    if sys.argv[1:2] == ['serve']:
+        return serve_main(sys.argv[2:])
     parser = argparse.ArgumentParser(description='将3D模型转换为Minecraft方块')
     
     # 必需参数
-    parser.add_argument('obj_file', help='Model file path | 模型文件路径')
-    parser.add_argument('world_path', help='Minecraft world path | Minecraft 世界路径')
+    parser.add_argument('obj_file', help='Model file path, or manifest path with --batch | 模型文件路径，或使用 --batch 时的清单文件路径')
+    parser.add_argument('world_path', nargs='?', help='Minecraft world path, or output file path with --output-format, not needed with --preview | Minecraft 世界路径，或使用 --output-format 时的输出文件路径，使用 --preview 时可省略')
     
     # 可选参数
     parser.add_argument('--start-pos', type=parse_tuple, default=START_POS,
@@ -30,6 +71,36 @@ def main():
                        help='rotate angle rx,ry,rz | 旋转角度 rx,ry,rz')
     parser.add_argument('--pitch', type=float, default=PITCH,
                        help='voxel pitch | 体素大小')
+    parser.add_argument('--max-blocks', type=int, default=0,
+                       help='choose the finest pitch whose estimated block count fits this budget, overrides --pitch | 选择估计方块数不超过该预算的最小体素大小，覆盖 --pitch')
+    parser.add_argument('--target-size', type=float, default=0,
+                       help='choose the pitch that makes the longest side of the model this many blocks, overrides --pitch | 选择使模型最长边为该方块数的体素大小，覆盖 --pitch')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE,
+                       help='stream voxelization in tiles of N x N chunks to bound memory, 0 to disable | 按 N x N 区块分块流式体素化以限制内存，0 表示不分块')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                       help='worker processes for multi-mesh models, 0 to use all cores | 多网格模型使用的工作进程数，0 表示使用全部核心')
+    parser.add_argument('--save-interval', type=int, default=SAVE_INTERVAL,
+                       help='save the world after every N meshes, 0 to save once at the end | 每处理 N 个网格保存一次世界，0 表示仅在结束时保存')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='world',
+                       help='write into a world, export a .schem/.nbt/.litematic file or a datapack folder of /fill commands | 写入世界，导出 .schem/.nbt/.litematic 文件或 /fill 命令数据包文件夹')
+    parser.add_argument('--batch', action='store_true',
+                       help='treat obj_file as a JSON/TOML manifest of models, the other options are defaults of its entries | 将 obj_file 视为模型清单（JSON/TOML），其余选项作为清单条目的默认值')
+    parser.add_argument('--incremental', action='store_true',
+                       help='only write blocks that changed since the previous incremental run of the same model, and clear blocks it no longer covers | 仅写入相对上次增量运行发生变化的方块，并清除不再覆盖的方块')
+    parser.add_argument('--no-backup', action='store_false', dest='backup',
+                       help='don\'t back up the chunks the conversion writes, which disables rollback | 不备份转换写入的区块，将无法回滚')
+    parser.add_argument('--preview', metavar='PNG',
+                       help='render top, isometric, front and side views to a PNG instead of writing anything, at a coarser pitch for large models | 渲染俯视、等轴测、正视和侧视图到 PNG 而不写入任何内容，大型模型会使用较粗的体素大小')
+    parser.add_argument('--server', type=parse_address, metavar='HOST:PORT',
+                       help='submit the conversion to a server started with "mcify.py serve" and print its logs | 将转换提交到 "mcify.py serve" 启动的服务器并输出日志')
+    parser.add_argument('--server-token', metavar='TOKEN',
+                       help='token printed by the server, MINECRAFTIFY_TOKEN by default | 服务器输出的令牌，默认读取 MINECRAFTIFY_TOKEN')
+    parser.add_argument('--profile', metavar='REPORT_JSON',
+                       help='write stage timings and counters to a JSON report | 将阶段耗时和计数写入 JSON 报告')
+    parser.add_argument('--profile-cpu', action='store_true',
+                       help='add cProfile results to the --profile report, which slows down the conversion | 在 --profile 报告中加入 cProfile 结果，会减慢转换')
+    parser.add_argument('--profile-memory', action='store_true',
+                       help='add tracemalloc results to the --profile report, which slows down the conversion | 在 --profile 报告中加入 tracemalloc 结果，会减慢转换')
     parser.add_argument('--version', type=parse_version, default=GAME_VERSION,
                        help='Minecraft version | Minecraft 版本')
     
@@ -42,21 +113,85 @@ def main():
                        help='don\'t use terracotta blocks | 不使用陶瓦方块')
     parser.add_argument('--no-glass', action='store_false', dest='glass',
                        help='don\'t use glass blocks | 不使用玻璃方块')
+    parser.add_argument('--no-cache', action='store_false', dest='use_cache',
+                       help='don\'t load or store cached voxelization results | 不读取或保存体素化缓存')
+    parser.add_argument('--sampler', choices=SAMPLERS, default=SAMPLER,
+                       help='texture sampling: texel nearest each voxel center, texels averaged over each voxel, or baked vertex colors | 纹理采样方式：取体素中心最近的纹素、对体素内纹素取平均，或烘焙顶点颜色')
+    parser.add_argument('--point-color', choices=POINT_REDUCTIONS, default=POINT_REDUCTION, dest='reduction',
+                       help='color of a voxel of a point cloud: mean, per-channel median or most common color of its points | 点云体素的颜色：其中点的平均值、逐通道中位数或出现最多的颜色')
+    parser.add_argument('--lut', action='store_true', dest='use_lut',
+                       help='match colors with a cached lookup table (faster, approximate) | 使用缓存的颜色查找表匹配方块（更快，近似）')
     
     args = parser.parse_args()
+    if args.batch and (args.max_blocks or args.target_size or args.preview or args.server):
+        parser.error('--max-blocks, --target-size, --preview and --server are not supported with --batch')
+    if args.world_path is None and not args.preview:
+        parser.error('the following arguments are required: world_path')
+    if (args.profile_cpu or args.profile_memory) and not args.profile:
+        parser.error('--profile-cpu and --profile-memory need --profile')
+    if args.server and (args.profile_cpu or args.profile_memory):
+        print("Note: cProfile and tracemalloc results are not collected for server jobs, the report only holds stage timings and counters")
+    profiler = Profiler(cprofile=args.profile_cpu, trace_memory=args.profile_memory) if args.profile else None
     
-    model_to_minecraft(
-        obj_file=args.obj_file,
-        world_path=args.world_path,
-        start_pos=args.start_pos,
-        rotate_angle=args.rotate,
-        pitch=args.pitch,
-        game_version=args.version,
-        wool=args.wool,
-        concrete=args.concrete,
-        terracotta=args.terracotta,
-        glass=args.glass
-    )
+    if args.batch:
+        batch_to_minecraft(
+            manifest_file=args.obj_file,
+            world_path=args.world_path,
+            game_version=args.version,
+            use_lut=args.use_lut,
+            use_cache=args.use_cache,
+            workers=args.workers,
+            output_format=args.output_format,
+            incremental=args.incremental,
+            backup=args.backup,
+            sampler=args.sampler,
+            reduction=args.reduction,
+            defaults={'start_pos': args.start_pos, 'rotate_angle': args.rotate, 'pitch': args.pitch, 'wool': args.wool, 'concrete': args.concrete, 'terracotta': args.terracotta, 'glass': args.glass},
+            profiler=profiler
+        )
+    else:
+        options = dict(
+            obj_file=args.obj_file,
+            world_path=args.world_path,
+            start_pos=args.start_pos,
+            rotate_angle=args.rotate,
+            pitch=args.pitch,
+            game_version=args.version,
+            wool=args.wool,
+            concrete=args.concrete,
+            terracotta=args.terracotta,
+            glass=args.glass,
+            use_lut=args.use_lut,
+            use_cache=args.use_cache,
+            tile_size=args.tile_size,
+            workers=args.workers,
+            save_interval=args.save_interval,
+            output_format=args.output_format,
+            incremental=args.incremental,
+            backup=args.backup,
+            sampler=args.sampler,
+            reduction=args.reduction,
+            max_blocks=args.max_blocks,
+            target_size=args.target_size,
+            preview=args.preview,
+        )
+        if args.server:
+            # The server resolves paths against its own working directory
+            from server import submit_job
+            for key in ('obj_file', 'world_path', 'preview'):
+                if options[key] is not None:
+                    options[key] = os.path.abspath(options[key])
+            job = submit_job(options, *args.server, args.server_token)
+            if job['status'] != 'done':
+                sys.exit(f"Conversion {job['status']}: {job['error'] or ''}")
+            if profiler is not None:
+                profiler.report = job['report']
+        else:
+            model_to_minecraft(**options, profiler=profiler)
+    if profiler is not None:
+        profiler.save(args.profile)
+        print(f"Profile report saved to {args.profile}")
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,116 @@
+import struct
+import zlib
+import numpy as np
+
+PANEL_SIZE = 400  # Target side length in pixels of each view
+PANEL_GAP = 8  # Pixels between two views
+BACKGROUND = (96, 96, 96)
+FACE_SHADES = (1.0, 0.8, 0.62)  # Brightness of the top, +z and +x faces in the isometric view
+# Orthographic views as (horizontal axis, vertical axis, depth axis) with signs, the viewer is on the positive depth side
+ORTHOGRAPHIC_VIEWS = {
+    'top': ((0, 1), (2, 1), (1, 1)),
+    'front': ((0, 1), (1, -1), (2, 1)),
+    'side': ((2, -1), (1, -1), (0, 1)),
+}
+
+# Write an (H, W, 3) uint8 image as an RGB PNG, so previews need nothing beyond numpy
+def write_png(path, image):
+    height, width, _ = image.shape
+    rows = np.concatenate([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, -1)], axis=1)
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+# Keep the nearest entry of each pixel: returns the indices of the entries with the largest depth per pixel
+def nearest_per_pixel(pixels, depth):
+    order = np.argsort(-depth, kind='stable')
+    _, first = np.unique(pixels[order], return_index=True)
+    return order[first]
+
+# Render an orthographic view along an axis, one square of scale pixels per block, shaded by depth
+def render_orthographic(coords, colors, view, scale=None):
+    (u_axis, u_sign), (v_axis, v_sign), (d_axis, d_sign) = ORTHOGRAPHIC_VIEWS[view]
+    u = coords[:, u_axis] * u_sign
+    v = coords[:, v_axis] * v_sign
+    depth = coords[:, d_axis] * d_sign
+    u, v = u - u.min(), v - v.min()
+    width, height = int(u.max()) + 1, int(v.max()) + 1
+    if scale is None:
+        scale = max(1, PANEL_SIZE // max(width, height))
+
+    visible = nearest_per_pixel(v.astype(np.int64) * width + u, depth)
+    near, far = depth.max(), depth.min()
+    shade = 0.55 + 0.45 * (depth[visible] - far) / max(near - far, 1)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = BACKGROUND
+    image[v[visible], u[visible]] = np.clip(colors[visible] * shade[:, None], 0, 255)
+    return image.repeat(scale, axis=0).repeat(scale, axis=1)
+
+# Get the pixels of an isometric block sprite of half width s: (rows, columns, face) with face 0 top, 1 +z side, 2 +x side
+def get_block_sprite(s):
+    rows, columns = np.mgrid[0:2 * s, 0:2 * s]
+    y, x = rows + 0.5, columns + 0.5
+    face = np.full(rows.shape, -1)
+    top = np.abs(x - s) / s + np.abs(y - s / 2) / (s / 2) <= 1
+    left = ~top & (x < s) & (y >= s / 2 + x / 2) & (y <= 3 * s / 2 + x / 2)
+    right = ~top & (x >= s) & (y >= s - (x - s) / 2) & (y <= 2 * s - (x - s) / 2)
+    face[top], face[left], face[right] = 0, 1, 2
+    keep = face >= 0
+    return rows[keep], columns[keep], face[keep]
+
+# Render an isometric view from the +x, +y, +z corner with a z-buffer over the pixels of every block sprite
+def render_isometric(coords, colors, s=None):
+    x, y, z = coords.T
+    # Screen position of each block in units of half a block width, +x goes right and down, +z left and down, +y up
+    u, v = x - z, x + z - 2 * y
+    u, v = u - u.min(), v - v.min()
+    if s is None:
+        units = max(int(u.max()) + 2, int(v.max()) // 2 + 2)
+        s = max(2, round(PANEL_SIZE / units / 2) * 2)
+    px, py = u * s, v * (s // 2)
+    width, height = int(px.max()) + 2 * s, int(py.max()) + 2 * s
+
+    sprite_rows, sprite_columns, sprite_faces = get_block_sprite(s)
+    rows = (py[:, None] + sprite_rows).ravel()
+    columns = (px[:, None] + sprite_columns).ravel()
+    blocks = np.repeat(np.arange(len(coords)), len(sprite_rows))
+    faces = np.tile(sprite_faces, len(coords))
+    visible = nearest_per_pixel(rows.astype(np.int64) * width + columns, (x + y + z)[blocks])
+
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = BACKGROUND
+    shade = np.array(FACE_SHADES)[faces[visible]]
+    image[rows[visible], columns[visible]] = np.clip(colors[blocks[visible]] * shade[:, None], 0, 255)
+    return image
+
+# Place images on a grid of rows, centering each one in its cell
+def compose(grid):
+    cell_height = max(image.shape[0] for row in grid for image in row)
+    cell_width = max(image.shape[1] for row in grid for image in row)
+    columns = max(len(row) for row in grid)
+    canvas = np.empty((len(grid) * (cell_height + PANEL_GAP) + PANEL_GAP, columns * (cell_width + PANEL_GAP) + PANEL_GAP, 3), dtype=np.uint8)
+    canvas[:] = BACKGROUND
+    for i, row in enumerate(grid):
+        for j, image in enumerate(row):
+            top = PANEL_GAP + i * (cell_height + PANEL_GAP) + (cell_height - image.shape[0]) // 2
+            left = PANEL_GAP + j * (cell_width + PANEL_GAP) + (cell_width - image.shape[1]) // 2
+            canvas[top:top + image.shape[0], left:left + image.shape[1]] = image
+    return canvas
+
+# Render a voxel model to a PNG of four views: top and isometric above, front (from +z) and side (from +x) below.
+# block_colors holds an RGB color per block name of the model
+def render_preview(model, path, block_colors):
+    print(f"Rendering preview of {len(model)} blocks to {path}...")
+    if len(model) == 0:
+        write_png(path, compose([[np.full((1, 1, 3), BACKGROUND, dtype=np.uint8)]]))
+        return
+    coords = model.coords.astype(np.int64)
+    colors = np.asarray(block_colors, dtype=np.float64)[model.block_indices]
+    write_png(path, compose([
+        [render_orthographic(coords, colors, 'top'), render_isometric(coords, colors)],
+        [render_orthographic(coords, colors, 'front'), render_orthographic(coords, colors, 'side')],
+    ]))
@@ -0,0 +1,349 @@
+import os
+import sys
+import hmac
+import json
+import time
+import queue
+import inspect
+import secrets
+import itertools
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tran
+# example: python mcify.py serve --port 8765, which prints the token of the server
+#          curl -X POST localhost:8765/jobs -H 'Content-Type: application/json' -H 'X-Minecraftify-Token: TOKEN' -d '{"obj_file": "/models/tree.obj", "world_path": "/saves/World"}'
+#          curl localhost:8765/jobs/1/events -H 'X-Minecraftify-Token: TOKEN'
+
+HOST = '127.0.0.1'  # Only local clients by default, jobs read and write any path the server can access
+PORT = 8765
+PROGRESS_INTERVAL = 0.1  # Minimum seconds between two progress events of a job
+TOKEN_HEADER = 'X-Minecraftify-Token'  # Header carrying the token of the server, which every request needs
+TOKEN_ENV = 'MINECRAFTIFY_TOKEN'  # Environment variable the command line client reads the token from
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')  # Host headers accepted besides the address the server listens on
+JOB_HISTORY = 100  # Finished jobs kept with their events, older ones are forgotten
+# Job options are the parameters of model_to_minecraft, except those the server provides
+JOB_KEYS = [name for name in inspect.signature(tran.model_to_minecraft).parameters if name not in ('call_back', 'world', 'profiler')]
+
+class JobCancelled(Exception):
+    pass
+
+# A conversion job and its ('log' | 'progress' | 'done' | 'error' | 'cancelled', value) events, kept for every reader
+class Job:
+    def __init__(self, job_id, options):
+        self.id = job_id
+        self.options = options
+        self.status = 'queued'
+        self.progress = 0.0
+        self.error = None
+        self.report = None
+        self.events = []
+        self.changed = threading.Condition()
+        self.cancelled = threading.Event()
+        self.last_progress = 0.0
+
+    def put(self, kind, value=None):
+        with self.changed:
+            self.events.append((kind, value))
+            self.changed.notify_all()
+
+    # Progress callback for model_to_minecraft, coalesced to at most one event per interval, stops the job once cancelled
+    def call_back(self, stage_index, stage_num, current_step, stage_steps):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        now = time.perf_counter()
+        if now - self.last_progress < PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        self.progress = (stage_index + current_step / stage_steps) / stage_num * 100
+        self.put('progress', self.progress)
+
+    def finish(self, status, value=None):
+        self.status = status
+        self.put(status, value)
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'error', 'cancelled')
+
+    # Yield the events from the first one, waiting for new ones until the job is finished
+    def follow(self):
+        sent = 0
+        while True:
+            with self.changed:
+                while sent == len(self.events) and not self.finished:
+                    self.changed.wait()
+                events, finished = self.events[sent:], self.finished
+            sent += len(events)
+            yield from events
+            if finished and sent == len(self.events):
+                return
+
+    def to_dict(self):
+        return {'id': self.id, 'status': self.status, 'progress': self.progress, 'error': self.error, 'report': self.report, 'options': self.options}
+
+# Route the prints of each job thread to the log events of its job, other threads print as usual
+class JobStdout:
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def write(self, string):
+        job = getattr(self.local, 'job', None)
+        if job is None:
+            return self.stdout.write(string)
+        job.put('log', string)
+        return len(string)
+
+    def flush(self):
+        self.stdout.flush()
+
+# Thread running the jobs of one world or output file in order, so writes to it are serialized while other
+# targets run concurrently. The world stays open between jobs, with its translated blocks and chunks warm
+class WorldWorker(threading.Thread):
+    def __init__(self, path, stdout):
+        super().__init__(daemon=True)
+        self.path = path
+        self.stdout = stdout
+        self.jobs = queue.Queue()
+        self.world = None
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.close_world()
+            elif not job.cancelled.is_set():
+                self.run_job(job)
+            else:
+                job.finish('cancelled')
+
+    def run_job(self, job):
+        job.status = 'running'
+        self.stdout.local.job = job
+        try:
+            options = job.options
+            world = None
+            if options.get('output_format', 'world') == 'world' and not options.get('preview'):
+                if self.world is None:
+                    from amulet import load_level
+                    print("Connecting to Minecraft world...")
+                    self.world = load_level(options['world_path'])
+                world = self.world
+            job.report = tran.model_to_minecraft(**options, call_back=job.call_back, world=world)
+            # The peak resident memory is the all-time peak of the server process, not of this job
+            job.report['process_peak_memory'] = job.report.pop('peak_memory')
+            job.finish('done', job.report)
+        except JobCancelled:
+            job.finish('cancelled')
+        except Exception as e:
+            job.error = str(e)
+            job.finish('error', job.error)
+        finally:
+            self.stdout.local.job = None
+            if self.world is not None:
+                # Drop the chunks and history of the job, along with the unsaved changes of a failed one,
+                # while the level and its translator stay loaded
+                self.world.purge()
+
+    def close_world(self):
+        if self.world is not None:
+            self.world.close()
+            self.world = None
+
+class ConversionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, token):
+        super().__init__(address, RequestHandler)
+        self.host = address[0]
+        self.token = token
+        self.stdout = JobStdout(sys.stdout)
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def get_worker(self, path):
+        key = os.path.normcase(os.path.abspath(path))
+        with self.lock:
+            if key not in self.workers:
+                self.workers[key] = WorldWorker(key, self.stdout)
+                self.workers[key].start()
+            return self.workers[key]
+
+    def submit(self, options):
+        options = parse_job(options)
+        with self.lock:
+            job = Job(next(self.job_ids), options)
+            self.jobs[job.id] = job
+            self.forget_jobs()
+        self.get_worker(options.get('preview') or options['world_path']).jobs.put(job)
+        return job
+
+    # Forget the oldest finished jobs beyond the history, so a long-running server doesn't keep every job and log line
+    def forget_jobs(self, history=JOB_HISTORY):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - history, 0)]:
+            del self.jobs[job_id]
+
+    # Close the world after its queued jobs, so other tools such as rollback can open it
+    def close_world(self, world_path):
+        self.get_worker(world_path).jobs.put(None)
+
+# Check the options of a job and convert their JSON values, raises ValueError for invalid options
+def parse_job(options):
+    if not isinstance(options, dict):
+        raise ValueError("The job must be a JSON object")
+    unknown = set(options) - set(JOB_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown job options: {', '.join(sorted(unknown))}")
+    if 'obj_file' not in options or ('world_path' not in options and not options.get('preview')):
+        raise ValueError("A job needs obj_file, and world_path unless it is a preview")
+    options = dict(options)
+    options.setdefault('world_path', None)
+    for key in ('start_pos', 'rotate_angle'):
+        if key in options:
+            options[key] = tuple(options[key])
+    if 'game_version' in options:
+        version = options['game_version']
+        if isinstance(version, str):
+            options['game_version'] = ('java', tuple(map(int, version.split('.'))))
+        else:
+            options['game_version'] = (version[0], tuple(version[1]))
+    return options
+
+# Get the host name of a Host header, without its port
+def get_host_name(host):
+    if host.startswith('['):
+        return host[1:].split(']')[0]
+    return host.rsplit(':', 1)[0] if host.count(':') == 1 else host
+
+# Requests must come with the token of the server and name it by a local Host, which keeps web pages from
+# submitting jobs through the browser, directly or by DNS rebinding. POST bodies must be JSON, which browsers
+# only send cross-origin after a CORS preflight that the server never answers
+class RequestHandler(BaseHTTPRequestHandler):
+    def check_request(self):
+        if get_host_name(self.headers.get('Host', '')) not in LOCAL_HOSTS + (self.server.host,):
+            self.send_json({'error': 'Host not allowed'}, 403)
+        elif not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ''), self.server.token):
+            self.send_json({'error': f'Missing or wrong {TOKEN_HEADER} header'}, 401)
+        elif self.command == 'POST' and self.headers.get_content_type() != 'application/json':
+            self.send_json({'error': 'Content-Type must be application/json'}, 415)
+        else:
+            return True
+        return False
+
+    def send_json(self, value, status=200):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        return json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+    def get_job(self, job_id):
+        job = self.server.jobs.get(int(job_id)) if job_id.isdigit() else None
+        if job is None:
+            self.send_json({'error': f'No job {job_id}'}, 404)
+        return job
+
+    # POST /jobs submits a job, POST /worlds/close closes a world after its queued jobs
+    def do_POST(self):
+        if not self.check_request():
+            return
+        try:
+            if self.path == '/jobs':
+                job = self.server.submit(self.read_json())
+                self.send_json({'id': job.id}, 202)
+            elif self.path == '/worlds/close':
+                self.server.close_world(self.read_json()['world_path'])
+                self.send_json({}, 202)
+            else:
+                self.send_json({'error': 'Not found'}, 404)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json({'error': str(e)}, 400)
+
+    # GET /jobs lists the jobs, GET /jobs/<id> gets one and GET /jobs/<id>/events streams its events as JSON lines
+    def do_GET(self):
+        if not self.check_request():
+            return
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            self.send_json([job.to_dict() for job in list(self.server.jobs.values())])
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.get_job(parts[1])
+            if job is not None:
+                self.send_json(job.to_dict())
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+            job = self.get_job(parts[1])
+            if job is None:
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            for kind, value in job.follow():
+                self.wfile.write(json.dumps({'kind': kind, 'value': value}).encode() + b'\n')
+                self.wfile.flush()
+        else:
+            self.send_json({'error': 'Not found'}, 404)
+
+    # DELETE /jobs/<id> cancels a job, nothing of it is saved unless the world is being saved
+    def do_DELETE(self):
+        if not self.check_request():
+            return
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'jobs':
+            job = self.get_job(parts[1])
+            if job is not None:
+                job.cancelled.set()
+                self.send_json(job.to_dict(), 202)
+        else:
+            self.send_json({'error': 'Not found'}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+# Run the server until interrupted, the heavy modules are imported before the first job
+# Without a token, a random one is generated and printed for the clients
+def serve(host=HOST, port=PORT, token=None):
+    server = ConversionServer((host, port), token or secrets.token_urlsafe(16))
+    sys.stdout = server.stdout
+    tran.warm_up()
+    print(f"Serving conversion jobs on http://{host}:{port}")
+    print(f"Token: {server.token}, send it in the {TOKEN_HEADER} header or set {TOKEN_ENV} for mcify.py --server")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# Send a request to a running server, raises ValueError with the error of a rejected request
+def open_request(url, token, body=None):
+    headers = {TOKEN_HEADER: token}
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+        body = json.dumps(body).encode()
+    try:
+        return urllib.request.urlopen(urllib.request.Request(url, body, headers))
+    except urllib.error.HTTPError as e:
+        raise ValueError(json.load(e)['error']) from None
+
+# Submit a job to a running server and print its logs as they arrive, returns the finished job
+def submit_job(options, host=HOST, port=PORT, token=None):
+    url = f'http://{host}:{port}'
+    token = token or os.environ.get(TOKEN_ENV, '')
+    with open_request(f'{url}/jobs', token, options) as response:
+        job_id = json.load(response)['id']
+    with open_request(f'{url}/jobs/{job_id}/events', token) as response:
+        for line in response:
+            event = json.loads(line)
+            if event['kind'] == 'log':
+                print(event['value'], end='')
+    with open_request(f'{url}/jobs/{job_id}', token) as response:
+        return json.load(response)
@@ -0,0 +1,35 @@
+import numpy as np
+from tran import VoxelModel, diff_placement
+
+BLOCK_NAMES = ["minecraft:red_wool", "minecraft:blue_wool"]
+
+def make_model(coords, block_indices):
+    return VoxelModel.from_coords(np.array(coords, dtype=np.int32), block_indices, BLOCK_NAMES)
+
+def get_cells(model):
+    return {(tuple(int(v) for v in cell), model.block_names[index]) for cell, index in zip(model.coords, model.block_indices)}
+
+def test_diff_placement():
+    previous = make_model([(0, 100, 0), (1, 100, 0), (2, 100, 0)], [0, 0, 0])
+    model = make_model([(0, 100, 0), (1, 100, 0), (3, 100, 0)], [0, 1, 0])
+    assert get_cells(diff_placement(previous, model)) == {
+        ((1, 100, 0), "minecraft:blue_wool"),
+        ((3, 100, 0), "minecraft:red_wool"),
+        ((2, 100, 0), "minecraft:air"),
+    }
+
+# Cells far from the origin must not collide with other cells, the world spans ±30M blocks
+def test_diff_placement_far_coordinates():
+    previous = make_model([(0, 101, 0), (-29_999_999, -64, 29_999_999)], [0, 0])
+    model = make_model([(0, 100, 1 << 21), (-29_999_999, -64, 29_999_999)], [0, 1])
+    assert get_cells(diff_placement(previous, model)) == {
+        ((0, 100, 1 << 21), "minecraft:red_wool"),
+        ((-29_999_999, -64, 29_999_999), "minecraft:blue_wool"),
+        ((0, 101, 0), "minecraft:air"),
+    }
+
+def test_diff_placement_empty():
+    previous = make_model(np.zeros((0, 3)), [])
+    model = make_model([(5, 70, -5)], [1])
+    assert get_cells(diff_placement(previous, model)) == {((5, 70, -5), "minecraft:blue_wool")}
+    assert len(diff_placement(model, previous)) == 1
@@ -1,9 +1,16 @@
-import trimesh
-from amulet import load_level
-from amulet.api.block import Block
-from math import sqrt
-from scipy.spatial import cKDTree
+import os
+import sys
+import shutil
+import json
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import itertools
+import threading
+import numpy as np
 from numpy import sin, cos, dot
+# trimesh, amulet and scipy are imported where they are used, so importing this module stays fast
 
 WOOL_PALETTE = {
     "minecraft:white_wool": (234, 236, 237),
@@ -80,55 +87,144 @@ GLASS_PALETTE = {
 START_POS = (0, -60, 0)  # Insertion start point, world coordinates (x, y, z)
 ROTATE_ANGLE = (0, 0, 0)  # Rotation angle (x, y, z), in degrees
 PITCH = 1.0  # Voxel size, smaller is finer (note MC block size limit)
+TILE_SIZE = 0  # Tile side length in chunks for streaming voxelization, 0 voxelizes each mesh at once
+WORKERS = 1  # Worker processes for voxelizing and color-matching meshes, 0 uses all cores
+SAVE_INTERVAL = 0  # Save the world after every this many meshes, 0 saves once at the end
 GAME_VERSION = ("java", (1, 20, 1))  # Minecraft version
+GLASS_ALPHA = 200  # Colors with alpha below this are matched to glass
+LUT_BITS = 6  # Bits per channel of the quantized color lookup table
+SAMPLER = 'uv'  # Texture sampling: 'uv' takes the texel nearest each voxel center, 'uv_mean' averages the texels over each voxel, 'vertex' bakes vertex colors
+SAMPLERS = ('uv', 'uv_mean', 'vertex')
+POINT_REDUCTION = 'mean'  # Color of a voxel from the points inside it: 'mean', per-channel 'median' or the 'majority' color
+POINT_REDUCTIONS = ('mean', 'median', 'majority')
+POINT_CHUNK = 1 << 21  # Points quantized at once, bounds the memory of point cloud voxelization besides the voxels
+MAJORITY_BITS = 4  # Bits per channel of the colors counted by the majority reduction
+PROBE_BLOCKS = 20000  # Voxels of the coarse probe voxelization used to estimate block counts
+PREVIEW_BLOCKS = 20000  # Block budget of previews, finer pitches are coarsened to fit it
+PREVIEW_PROBE_BLOCKS = 2000  # Smaller probe for previews, which only need a rough estimate
+CACHE_DIR = 'cache'  # Directory for cached lookup tables and voxelization results
+VOXEL_CACHE_SIZE = 2 << 30  # Size cap of the voxelization cache in bytes, least recently used entries are evicted first
+PLACEMENT_DIR = 'minecraftify'  # Directory inside the world for the placement manifests of incremental runs and chunk backups
+BACKUP_LIMIT = 10  # Chunk backups kept per world, the oldest are deleted first
 
 def call_back_null(stage_index, stage_num, current_step, stage_steps):
     pass
 
-# Find the closest block in the palette based on color
-def find_closest_block_with_glass(color, palette, glass_palette=GLASS_PALETTE):
-    r, g, b, a = color
-    min_distance = float('inf')
-    closest_block = None
-    if a < 200:
-        for block_name, (br, bg, bb) in glass_palette.items():
-            distance = sqrt((r-br)**2 + (g-bg)**2 + (b-bb)**2)
-            if distance < min_distance:
-                min_distance = distance
-                closest_block = block_name
-    else:
-        for block_name, (br, bg, bb) in palette.items():
-            distance = sqrt((r-br)**2 + (g-bg)**2 + (b-bb)**2)
-            if distance < min_distance:
-                min_distance = distance
-                closest_block = block_name
-    return closest_block
-def find_closest_block_without_glass(color, palette):
-    r, g, b, a = color
-    min_distance = float('inf')
-    closest_block = None
-    for block_name, (br, bg, bb) in palette.items():
-        distance = sqrt((r-br)**2 + (g-bg)**2 + (b-bb)**2)
-        if distance < min_distance:
-            min_distance = distance
-            closest_block = block_name
-    return closest_block
-def find_closest_block_only_glass(color, palette, glass_palette=GLASS_PALETTE):
-    r, g, b, a = color
-    min_distance = float('inf')
-    closest_block = None
-    for block_name, (br, bg, bb) in glass_palette.items():
-        distance = sqrt((r-br)**2 + (g-bg)**2 + (b-bb)**2)
-        if distance < min_distance:
-            min_distance = distance
-            closest_block = block_name
-    return closest_block
-
-# Get the color of a voxel
-def get_voxel_color(point, colors, tree):
-    _, index = tree.query(point)
-    voxel_color = colors[index]
-    return voxel_color
+# Get the peak resident memory of the process in bytes
+def get_peak_memory():
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [(name, ctypes.c_size_t) for name in (
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Per-stage timings and counters of a conversion run, with optional cProfile and tracemalloc capture
+class Profiler:
+    def __init__(self, cprofile=False, trace_memory=False):
+        self.cprofile = cprofile
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.counters = {}
+        self.unique_blocks = set()
+        self.touched_chunks = set()
+        self.report = {}
+        self._profile = None
+        self._start_time = None
+
+    # Time a stage, time of repeated stages adds up
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start_time
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    # Add the stages and counters of a worker process
+    def merge(self, stages, counters):
+        for name, seconds in stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, value in counters.items():
+            self.count(name, value)
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.cprofile:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    # Stop capturing and build the report
+    def stop(self, top=30):
+        report = {
+            'total_time': time.perf_counter() - self._start_time,
+            'stages': self.stages,
+            'counters': dict(self.counters, unique_blocks=len(self.unique_blocks), chunks_touched=len(self.touched_chunks)),
+            'peak_memory': get_peak_memory(),
+        }
+        if self._profile is not None:
+            import pstats
+            self._profile.disable()
+            stats = pstats.Stats(self._profile)
+            entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            report['cprofile'] = [
+                {'function': f'{file}:{line}({name})', 'calls': calls, 'total_time': total_time, 'cumulative_time': cumulative_time}
+                for (file, line, name), (_, calls, total_time, cumulative_time, _) in entries
+            ]
+            self._profile = None
+        if self.trace_memory:
+            import tracemalloc
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            report['tracemalloc'] = {
+                'peak': peak,
+                'top': [{'location': str(stat.traceback), 'size': stat.size, 'count': stat.count} for stat in snapshot.statistics('lineno')[:top]],
+            }
+        self.report = report
+        return report
+
+    def summary(self):
+        return ', '.join(f'{name} {seconds:.2f}s' for name, seconds in self.stages.items())
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report, f, indent=2)
+
+# Profiler of the running conversion, kept per thread so the conversions of a server can run side by side
+class ThreadProfiler(threading.local):
+    def __init__(self):
+        self.current = Profiler()
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+_profiler = ThreadProfiler()
+
+# Get the colors of all voxels in one batched, multi-threaded KD-tree query
+def sample_voxel_colors(points, colors, tree, workers=-1):
+    print("Sampling voxel colors...")
+    start_time = time.perf_counter()
+    with _profiler.stage('color_sampling'):
+        _, indices = tree.query(np.asarray(points, dtype=np.float64).reshape(-1, 3), workers=workers)
+        voxel_colors = np.ascontiguousarray(np.asarray(colors)[indices])
+    print(f"Sampled {len(voxel_colors)} voxel colors in {time.perf_counter() - start_time:.2f}s")
+    return voxel_colors
 
 # Get the palette based on the selected blocks
 def get_palette(wool=True, concrete=True, terracotta=True):
@@ -141,47 +237,482 @@ def get_palette(wool=True, concrete=True, terracotta=True):
         palette.update(TERRACOTTA_PALETTE)
     return palette
 
-# Get the block function based on the selected blocks
-def get_block_function(wool=True, concrete=True, terracotta=True, glass=True):
-    if wool or concrete or terracotta:
-        if glass:
-            return find_closest_block_with_glass
-        else:
-            return find_closest_block_without_glass
+# Get the RGB color of each block name
+def get_block_colors(block_names):
+    colors = {**WOOL_PALETTE, **CONCRETE_PALETTE, **TERRACOTTA_PALETTE, **GLASS_PALETTE}
+    return np.array([colors[name] for name in block_names], dtype=np.uint8).reshape(-1, 3)
+
+# Get the block table of the selected blocks: block names (solid first, then glass) and KD-trees over their colors
+_block_tables = {}
+def get_block_table(wool=True, concrete=True, terracotta=True, glass=True):
+    key = (wool, concrete, terracotta, glass)
+    if key not in _block_tables:
+        from scipy.spatial import cKDTree
+        palette = get_palette(wool, concrete, terracotta)
+        glass_palette = GLASS_PALETTE if glass or not palette else {}
+        names = list(palette) + list(glass_palette)
+        solid_tree = cKDTree(np.array(list(palette.values()), dtype=np.float64)) if palette else None
+        glass_tree = cKDTree(np.array(list(glass_palette.values()), dtype=np.float64)) if glass_palette else None
+        _block_tables[key] = (names, solid_tree, glass_tree)
+    return _block_tables[key]
+
+# Match an (N, 4) RGBA array against the block table exactly, returns indices into the block names
+def match_block_table(colors, block_table):
+    names, solid_tree, glass_tree = block_table
+    colors = np.asarray(colors)
+    indices = np.zeros(len(colors), dtype=np.uint8)
+    if solid_tree is None:
+        is_glass = np.ones(len(colors), dtype=bool)
+    elif glass_tree is None:
+        is_glass = np.zeros(len(colors), dtype=bool)
     else:
-        return find_closest_block_only_glass
+        is_glass = colors[:, 3] < GLASS_ALPHA
+    if solid_tree is not None and not is_glass.all():
+        _, indices[~is_glass] = solid_tree.query(colors[~is_glass, :3])
+    if glass_tree is not None and is_glass.any():
+        _, glass_indices = glass_tree.query(colors[is_glass, :3])
+        indices[is_glass] = glass_indices + (len(names) - glass_tree.n)
+    return indices
+
+# Get the quantized RGB lookup table of the block table, built lazily and cached on disk
+# Row 0 holds the opaque match and row 1 the transparent match of each quantized color
+_color_luts = {}
+def get_color_lut(block_table, bits=LUT_BITS):
+    names, solid_tree, glass_tree = block_table
+    colors = [tuple(tree.data[i]) for tree in (solid_tree, glass_tree) if tree is not None for i in range(tree.n)]
+    digest = hashlib.md5(repr((names, colors, GLASS_ALPHA)).encode()).hexdigest()[:16]
+    key = (digest, bits)
+    if key in _color_luts:
+        return _color_luts[key]
+    lut_file = os.path.join(CACHE_DIR, f'lut_{digest}_{bits}.npy')
+    if os.path.exists(lut_file):
+        try:
+            lut = np.load(lut_file)
+            if lut.shape == (2, 1 << (3 * bits)):
+                _color_luts[key] = lut
+                return lut
+        except (OSError, ValueError):
+            pass
+    print("Building color lookup table...")
+    levels = (np.arange(1 << bits) << (8 - bits)) + (1 << (7 - bits))
+    r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+    centers = np.stack([r.ravel(), g.ravel(), b.ravel(), np.full(r.size, 255)], axis=1)
+    lut = np.empty((2, len(centers)), dtype=np.uint8)
+    lut[0] = match_block_table(centers, block_table)
+    centers[:, 3] = 0
+    lut[1] = match_block_table(centers, block_table)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        np.save(lut_file, lut)
+    except OSError:
+        pass
+    _color_luts[key] = lut
+    return lut
 
-# Load the model
+# Find the closest blocks for an (N, 4) RGBA array in one pass, returns indices into the block names
+def find_closest_blocks(colors, block_table, use_lut=False):
+    with _profiler.stage('block_matching'):
+        if not use_lut:
+            return match_block_table(colors, block_table)
+        bits = LUT_BITS
+        lut = get_color_lut(block_table, bits)
+        colors = np.asarray(colors).astype(np.uint8)
+        rgb = (colors[:, :3] >> (8 - bits)).astype(np.intp)
+        flat = (rgb[:, 0] << (2 * bits)) | (rgb[:, 1] << bits) | rgb[:, 2]
+        return lut[(colors[:, 3] < GLASS_ALPHA).astype(np.intp), flat]
+
+# Get the uniform scale of a transform, None if it scales the axes differently or shears them
+def get_uniform_scale(matrix):
+    linear = np.asarray(matrix, dtype=np.float64)[:3, :3]
+    scale = abs(np.linalg.det(linear)) ** (1 / 3)
+    if scale == 0 or not np.allclose(linear @ linear.T, np.eye(3) * scale ** 2, rtol=1e-4, atol=1e-6 * scale ** 2):
+        return None
+    return scale
+
+# Load the model, returns a list of (mesh, transforms) pairs
+# Each mesh is voxelized once and stamped at its (K, 4, 4) instance transforms, which share one uniform scale
 def load_model(obj_file):
+    import trimesh
     print(f"Loading model from {obj_file}...")
     mesh = trimesh.load(obj_file)
     print(f'Type of mesh: {type(mesh)}')
     if type(mesh) == trimesh.Scene:
-        meshes = list(mesh.geometry.values())
-    elif type(mesh) == trimesh.Trimesh:
-        meshes = [mesh]
+        groups = {}
+        hashes = {}  # Content hash per geometry name, instances of one geometry are hashed once
+        for node in mesh.graph.nodes_geometry:
+            transform, geometry_name = mesh.graph[node]
+            geometry = mesh.geometry[geometry_name]
+            if type(geometry) not in (trimesh.Trimesh, trimesh.PointCloud):
+                print(f"Skipping {geometry_name}, unsupported geometry type: {type(geometry)}")
+                continue
+            scale = get_uniform_scale(transform)
+            if scale is None:
+                # A non-uniform transform can't be stamped onto the voxel grid, bake it into the mesh instead
+                groups[(geometry_name, node)] = (geometry.copy().apply_transform(transform), [np.eye(4)])
+            else:
+                # Group instances by content, so identical geometries stored under different names are voxelized once too
+                if geometry_name not in hashes:
+                    hashes[geometry_name] = hash_mesh(geometry)
+                rotation = np.eye(4)
+                rotation[:3, :3] = transform[:3, :3] / scale
+                if is_grid_aligned(rotation[:3, :3]):
+                    groups.setdefault((hashes[geometry_name], round(scale, 6)), (geometry, []))[1].append(transform)
+                else:
+                    # Other rotations would resample the voxel grid and leave holes, so instances sharing a rotation
+                    # are voxelized once with the rotation baked in and stamped with the rest of their transform
+                    key = (hashes[geometry_name], round(scale, 6), tuple(np.round(rotation[:3, :3], 6).ravel()))
+                    if key not in groups:
+                        groups[key] = (geometry.copy().apply_transform(rotation), [])
+                    groups[key][1].append(transform @ rotation.T)
+        models = [(geometry, np.array(transforms, dtype=np.float64)) for geometry, transforms in groups.values()]
+    elif type(mesh) in (trimesh.Trimesh, trimesh.PointCloud):
+        models = [(mesh, np.eye(4)[None])]
     else:
         raise TypeError(f"Unsupported mesh type: {type(mesh)}")
-    print(f"Model loaded, {len(meshes)} meshes in total")
-    return meshes
+    print(f"Model loaded, {len(models)} meshes with {sum(len(transforms) for _, transforms in models)} instances in total")
+    return models
+
+# Check whether a rotation maps the voxel grid onto itself, i.e. turns by multiples of 90 degrees
+def is_grid_aligned(rotation):
+    return np.allclose(rotation, np.round(rotation), atol=1e-6)
+
+# Stamp voxel points and their block indices at each instance transform
+def stamp_instances(points, block_indices, transforms):
+    if len(transforms) == 1 and np.allclose(transforms[0], np.eye(4)):
+        return points, block_indices
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    points = np.concatenate([points @ transform[:3, :3].T + transform[:3, 3] for transform in transforms])
+    return points, np.tile(block_indices, len(transforms))
+
+# Get the pitch to voxelize a mesh at, so its instances come out at the target pitch
+def get_instance_pitch(transforms, pitch=PITCH):
+    return pitch / get_uniform_scale(transforms[0])
+
+# Hash the geometry and the texture of a mesh, used as the voxelization cache key
+def hash_mesh(mesh, sampler=SAMPLER, reduction=POINT_REDUCTION):
+    import trimesh
+    geometry = hashlib.md5()
+    geometry.update(np.ascontiguousarray(mesh.vertices, dtype=np.float64).tobytes())
+    texture = hashlib.md5(type(mesh.visual).__name__.encode())
+    if type(mesh) == trimesh.PointCloud:
+        texture.update(reduction.encode())
+        texture.update(np.ascontiguousarray(mesh.colors).tobytes())
+        return geometry.hexdigest()[:16], texture.hexdigest()[:16]
+    geometry.update(np.ascontiguousarray(mesh.faces, dtype=np.int64).tobytes())
+    if type(mesh.visual) == trimesh.visual.TextureVisuals:
+        if mesh.visual.uv is not None:
+            texture.update(np.ascontiguousarray(mesh.visual.uv, dtype=np.float64).tobytes())
+        texture.update(sampler.encode())
+        material = mesh.visual.material
+        texture.update(type(material).__name__.encode())
+        for name in ('main_color', 'baseColorFactor'):
+            if getattr(material, name, None) is not None:
+                texture.update(np.asarray(getattr(material, name)).tobytes())
+        for name in ('image', 'baseColorTexture'):
+            image = getattr(material, name, None)
+            if image is not None:
+                texture.update(f'{image.mode}{image.size}'.encode())
+                texture.update(image.tobytes())
+    else:
+        texture.update(np.ascontiguousarray(mesh.visual.vertex_colors).tobytes())
+    return geometry.hexdigest()[:16], texture.hexdigest()[:16]
+
+# Get the file of a voxelization cache entry
+def get_voxel_cache_file(mesh_hash, pitch):
+    geometry_hash, texture_hash = mesh_hash
+    return os.path.join(CACHE_DIR, 'voxels', f'{geometry_hash}_{texture_hash}_{float(pitch)!r}.npz')
+
+# Load voxel points and colors from the cache, returns None on a miss
+def load_voxel_cache(mesh_hash, pitch):
+    import trimesh
+    cache_file = get_voxel_cache_file(mesh_hash, pitch)
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file) as data:
+            points = trimesh.transform_points(data['indices'].astype(np.float64), data['transform'])
+            voxel_colors = data['colors']
+        os.utime(cache_file)  # Mark as recently used
+    except (OSError, ValueError, KeyError):
+        return None
+    return points, voxel_colors
+
+# Save voxel indices, grid transform and colors to the cache and evict old entries over the size cap
+def save_voxel_cache(mesh_hash, pitch, indices, transform, voxel_colors, size_limit=VOXEL_CACHE_SIZE):
+    cache_file = get_voxel_cache_file(mesh_hash, pitch)
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = f'{cache_file}.{os.getpid()}.tmp'  # Worker processes may write the same entry
+        with open(temp_file, 'wb') as f:
+            np.savez(f, indices=np.asarray(indices, dtype=np.int32), transform=transform, colors=voxel_colors)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        return
+    evict_voxel_cache(size_limit)
+
+# Remove least recently used cache entries until the cache fits the size cap
+def evict_voxel_cache(size_limit=VOXEL_CACHE_SIZE):
+    cache_dir = os.path.join(CACHE_DIR, 'voxels')
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz'):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total_size <= size_limit:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+            total_size -= size
+        except OSError:
+            pass
+
+# Voxelize a textured mesh the way trimesh's voxelize_subdivide does, keeping the source face of each subdivided vertex.
+# The vertices are surface points inside their voxel, their UVs are interpolated with barycentric weights and their
+# texels gathered in one pass. Returns the voxel grid and the voxel colors
+def voxelize_texture(mesh, pitch=PITCH, sampler=SAMPLER):
+    import trimesh
+    with _profiler.stage('voxelize'):
+        vertices, faces, face_index = trimesh.remesh.subdivide_to_size(mesh.vertices, mesh.faces, max_edge=pitch / 2, max_iter=10, return_index=True)
+        hit = np.round(vertices / pitch).astype(np.int64)
+        origin = hit.min(axis=0)
+        shape = tuple(hit.max(axis=0) - origin + 1)
+        keys, inverse = np.unique(np.ravel_multi_index((hit - origin).T, shape), return_inverse=True)
+        occupied = np.stack(np.unravel_index(keys, shape), axis=1) + origin
+        voxels = trimesh.voxel.VoxelGrid(
+            trimesh.voxel.encoding.SparseBinaryEncoding(occupied - origin),
+            transform=trimesh.transformations.scale_and_translate(scale=pitch, translate=origin * pitch))
+
+    with _profiler.stage('color_sampling'):
+        if sampler == 'uv_mean':
+            samples = np.arange(len(vertices))
+        else:
+            # Keep the surface point closest to the center of each voxel, in voxel order
+            distance = np.linalg.norm(vertices - hit * pitch, axis=1) / pitch  # Below 1
+            order = np.argsort(inverse + distance)
+            samples = order[np.r_[True, inverse[order][1:] != inverse[order][:-1]]]
+        vertex_faces = np.empty(len(vertices), dtype=np.int64)
+        vertex_faces[faces.reshape(-1)] = np.repeat(face_index, 3)
+        source_faces = vertex_faces[samples]
+        barycentric = np.nan_to_num(trimesh.triangles.points_to_barycentric(mesh.triangles[source_faces], vertices[samples]), nan=1/3)
+        uv = np.einsum('ij,ijk->ik', barycentric, np.asarray(mesh.visual.uv, dtype=np.float64)[mesh.faces[source_faces]])
+        colors = mesh.visual.material.to_color(uv)
+        colors = np.broadcast_to(np.asarray(colors if colors is not None else [255, 255, 255, 255], dtype=np.float64), (len(samples), 4))
+        if sampler == 'uv_mean':
+            counts = np.bincount(inverse, minlength=len(occupied))
+            colors = np.stack([np.bincount(inverse, weights=colors[:, channel], minlength=len(occupied)) for channel in range(4)], axis=1) / counts[:, None]
+        voxel_colors = np.ascontiguousarray(np.rint(colors), dtype=np.uint8)
+    return voxels, voxel_colors
+
+# Get the (N, 4) RGBA colors of a point cloud, uncolored clouds get the default color of trimesh
+def get_point_colors(cloud):
+    import trimesh
+    if len(cloud.colors) == len(cloud.vertices):
+        return cloud.colors
+    return np.broadcast_to(np.asarray(trimesh.visual.DEFAULT_COLOR, dtype=np.uint8), (len(cloud.vertices), 4))
 
-# Voxelize the model
-def voxelize_model(mesh, pitch=PITCH):
+# Quantize points to the voxel grid, voxel i is centered at i * pitch like the voxels of trimesh
+def quantize_points(vertices, pitch=PITCH):
+    return np.floor(np.asarray(vertices, dtype=np.float64) / pitch + 0.5).astype(np.int64)
+
+# Sum the value rows of equal keys, returns the unique keys and their summed values
+def reduce_table(keys, values):
+    keys, inverse = np.unique(keys, return_inverse=True)
+    sums = np.empty((len(keys), values.shape[1]), dtype=np.float64)
+    for column in range(values.shape[1]):
+        sums[:, column] = np.bincount(inverse, weights=values[:, column], minlength=len(keys))
+    return keys, sums
+
+# Build the table of a chunk of points: keys and value rows that are summed per key. Voxels are numbered by groups,
+# mean sums (count, r, g, b, a) per voxel, majority per voxel and quantized color, median counts every channel value per voxel
+def point_table(groups, colors, reduction=POINT_REDUCTION):
+    if reduction == 'median':
+        channels = np.arange(4, dtype=np.int64)
+        keys = (((groups[:, None] << 2) | channels) << 8) | colors.astype(np.int64)
+        return keys.ravel(), np.ones((keys.size, 1))
+    values = np.column_stack([np.ones(len(colors)), colors])
+    if reduction == 'majority':
+        shift = 8 - MAJORITY_BITS
+        quantized = colors.astype(np.int64) >> shift
+        color_keys = sum(quantized[:, i] << (MAJORITY_BITS * i) for i in range(4))
+        return (groups << (4 * MAJORITY_BITS)) | color_keys, values
+    return groups, values
+
+# Turn the summed table into one color per voxel, returns the voxel groups and their RGBA colors
+def finish_point_table(keys, sums, reduction=POINT_REDUCTION):
+    if reduction == 'median':
+        # Keys are sorted, so the values of each (voxel, channel) group are consecutive and ascending
+        groups, values = keys >> 8, keys & 0xff
+        counts = sums[:, 0]
+        starts = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+        group_index = np.cumsum(np.concatenate(([False], groups[1:] != groups[:-1])))
+        cumulative = np.cumsum(counts)
+        before = (cumulative - counts)[starts][group_index]
+        totals = np.add.reduceat(counts, starts)[group_index]
+        reached = (cumulative - before) * 2 >= totals
+        _, first = np.unique(group_index[reached], return_index=True)
+        medians = values[np.flatnonzero(reached)[first]].reshape(-1, 4)
+        return groups[starts][::4] >> 2, medians.astype(np.uint8)
+    if reduction == 'majority':
+        groups = keys >> (4 * MAJORITY_BITS)
+        order = np.lexsort((-sums[:, 0], groups))
+        groups, first = np.unique(groups[order], return_index=True)
+        keys, sums = groups, sums[order[first]]
+    return keys, np.rint(sums[:, 1:] / sums[:, :1]).astype(np.uint8)
+
+# Voxelize a point cloud by binning its points into voxels and reducing their colors with grouped NumPy operations.
+# The voxel keys of the points are computed chunk by chunk and sorted once, then the reduction runs over chunks of
+# whole voxels, so memory is bounded by two int64 arrays over the points besides the chunk. Returns the voxel indices and colors
+def voxelize_points(vertices, colors, pitch=PITCH, reduction=POINT_REDUCTION, chunk_size=POINT_CHUNK):
+    with _profiler.stage('voxelize'):
+        low = quantize_points(vertices.min(axis=0), pitch)
+        shape = tuple(quantize_points(vertices.max(axis=0), pitch) - low + 1)
+        keys = np.empty(len(vertices), dtype=np.int64)
+        for start in range(0, len(vertices), chunk_size):
+            keys[start:start + chunk_size] = np.ravel_multi_index((quantize_points(vertices[start:start + chunk_size], pitch) - low).T, shape)
+        order = np.argsort(keys)
+        keys = keys[order]
+
+    cells, voxel_colors = [], []
+    start = 0
+    while start < len(keys):
+        # Extend the chunk to the end of its last voxel
+        end = int(np.searchsorted(keys, keys[min(start + chunk_size, len(keys)) - 1], side='right'))
+        with _profiler.stage('color_sampling'):
+            chunk_cells, groups = np.unique(keys[start:end], return_inverse=True)
+            groups, chunk_colors = finish_point_table(*reduce_table(*point_table(groups, colors[order[start:end]], reduction)), reduction)
+        cells.append(chunk_cells[groups])
+        voxel_colors.append(chunk_colors)
+        start = end
+    indices = np.stack(np.unravel_index(np.concatenate(cells), shape), axis=1) + low
+    return indices, np.concatenate(voxel_colors)
+
+# Whether a mesh is colored by sampling its texture rather than baking vertex colors
+def uses_texture_sampler(mesh, sampler=SAMPLER):
+    import trimesh
+    return sampler != 'vertex' and type(mesh.visual) == trimesh.visual.TextureVisuals and mesh.visual.uv is not None
+
+# Voxelize the model, returns the voxel points and their colors
+def voxelize_model(mesh, pitch=PITCH, use_cache=True, sampler=SAMPLER, reduction=POINT_REDUCTION):
+    import trimesh
+    from scipy.spatial import cKDTree
     print("Voxelizing model...")
     print(f'Type of visual: {type(mesh.visual)}')
+    if use_cache:
+        mesh_hash = hash_mesh(mesh, sampler, reduction)
+        cached = load_voxel_cache(mesh_hash, pitch)
+        if cached is not None:
+            points, voxel_colors = cached
+            _profiler.count('cache_hits')
+            print(f"Voxelization loaded from cache, {len(points)} blocks in total")
+            return points, voxel_colors
+    if type(mesh) == trimesh.PointCloud:
+        indices, voxel_colors = voxelize_points(mesh.vertices, get_point_colors(mesh), pitch, reduction)
+        print(f"Voxelization completed, {len(indices)} blocks in total, reduced from {len(mesh.vertices)} points")
+        transform = np.diag([pitch, pitch, pitch, 1.0])
+        if use_cache:
+            save_voxel_cache(mesh_hash, pitch, indices, transform, voxel_colors)
+        return indices * pitch, voxel_colors
     if type(mesh.visual) == trimesh.visual.TextureVisuals:
         # If the material is a SimpleMaterial and the image is None, set the image to a color image
         if type(mesh.visual.material) == trimesh.visual.material.SimpleMaterial and mesh.visual.material.image is None:
             mesh.visual.material.image = trimesh.visual.material.color_image(mesh.visual.material.main_color)
+        if uses_texture_sampler(mesh, sampler):
+            voxels, voxel_colors = voxelize_texture(mesh, pitch, sampler)
+            points = voxels.points
+            print(f"Voxelization completed, {len(points)} blocks in total, sampled from the texture")
+            if use_cache:
+                save_voxel_cache(mesh_hash, pitch, voxels.sparse_indices, voxels.transform, voxel_colors)
+            return points, voxel_colors
         mesh.visual = mesh.visual.to_color() # Convert to ColorVisuals
         #mesh.visual = trimesh.visual.ColorVisuals(mesh=mesh) # Convert to ColorVisuals
     colors = mesh.visual.vertex_colors  # Get vertex colors
     vertices = mesh.vertices
-    tree = cKDTree(vertices)  # Build a KDTree for fast color lookup
-    voxels = mesh.voxelized(pitch=pitch)
-    points = voxels.points  # Voxel coordinates
+    with _profiler.stage('color_sampling'):
+        tree = cKDTree(vertices)  # Build a KDTree for fast color lookup
+    with _profiler.stage('voxelize'):
+        voxels = mesh.voxelized(pitch=pitch)
+        points = voxels.points  # Voxel coordinates
     print(f"Voxelization completed, {len(points)} blocks in total")
-    return points, colors, tree
+    voxel_colors = sample_voxel_colors(points, colors, tree)
+    if use_cache:
+        save_voxel_cache(mesh_hash, pitch, voxels.sparse_indices, voxels.transform, voxel_colors)
+    return points, voxel_colors
+
+# Voxelize the model tile by tile, yields integer world coordinates and colors of each tile
+# Tiles are tile_size x tile_size chunk columns in world space, so peak memory is bounded by the tile and not by the model
+def voxelize_tiles(mesh, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH, tile_size=TILE_SIZE, sampler=SAMPLER):
+    import trimesh
+    from scipy.spatial import cKDTree
+    print("Voxelizing model in tiles...")
+    print(f'Type of visual: {type(mesh.visual)}')
+    textured = uses_texture_sampler(mesh, sampler)
+    if type(mesh.visual) == trimesh.visual.TextureVisuals:
+        if type(mesh.visual.material) == trimesh.visual.material.SimpleMaterial and mesh.visual.material.image is None:
+            mesh.visual.material.image = trimesh.visual.material.color_image(mesh.visual.material.main_color)
+        if not textured:
+            mesh.visual = mesh.visual.to_color() # Convert to ColorVisuals
+    colors = None if textured else mesh.visual.vertex_colors
+    faces = mesh.faces
+    tile_blocks = 16 * tile_size
+
+    # Find the range of tiles touched by each face, with a margin for voxel rounding
+    rotation_matrix = calculate_rotation_matrix(rotate_angle, pitch)
+    world_vertices = mesh.vertices @ rotation_matrix.T + np.asarray(start_pos, dtype=np.float64)
+    face_tiles = []
+    for axis in (0, 2):
+        face_axis = world_vertices[:, axis][faces]
+        face_tiles.append(np.floor((face_axis.min(axis=1) - 2) / tile_blocks).astype(np.int64))
+        face_tiles.append(np.floor((face_axis.max(axis=1) + 2) / tile_blocks).astype(np.int64))
+    del world_vertices
+    min_tx, max_tx, min_tz, max_tz = face_tiles
+
+    # Bucket the faces by tile once: expand each face into the tiles of its range and sort by tile, so only
+    # tiles with faces are visited and each visit takes its faces as one slice
+    spans_x, spans_z = max_tx - min_tx + 1, max_tz - min_tz + 1
+    counts = spans_x * spans_z
+    face_ids = np.repeat(np.arange(len(faces)), counts)
+    offsets = np.arange(len(face_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile_x = min_tx[face_ids] + offsets // spans_z[face_ids]
+    tile_z = min_tz[face_ids] + offsets % spans_z[face_ids]
+    del offsets
+    order = np.lexsort((tile_z, tile_x))
+    face_ids, tile_x, tile_z = face_ids[order], tile_x[order], tile_z[order]
+    bounds = np.flatnonzero((tile_x[1:] != tile_x[:-1]) | (tile_z[1:] != tile_z[:-1])) + 1
+    starts, ends = np.concatenate(([0], bounds)), np.concatenate((bounds, [len(face_ids)]))
+    print(f"Model spans {len(starts)} tiles of {tile_blocks}x{tile_blocks} blocks")
+
+    for tile_index, (start, end) in enumerate(zip(starts, ends)):
+        tx, tz = int(tile_x[start]), int(tile_z[start])
+        # Voxelize the faces near the tile, the voxel grid is aligned to multiples of pitch so tiles line up
+        vertex_ids, tile_faces = np.unique(faces[face_ids[start:end]], return_inverse=True)
+        tile_vertices = mesh.vertices[vertex_ids]
+        if textured:
+            visual = trimesh.visual.TextureVisuals(uv=mesh.visual.uv[vertex_ids], material=mesh.visual.material)
+            tile_mesh = trimesh.Trimesh(tile_vertices, tile_faces.reshape(-1, 3), visual=visual, process=False)
+            voxels, tile_colors = voxelize_texture(tile_mesh, pitch, sampler)
+            points = voxels.points
+        else:
+            with _profiler.stage('voxelize'):
+                tile_mesh = trimesh.Trimesh(tile_vertices, tile_faces.reshape(-1, 3), process=False)
+                points = tile_mesh.voxelized(pitch=pitch).points
+        coords = transform_points(points, start_pos, rotate_angle, pitch)
+
+        # Keep the voxels whose world cell belongs to this tile
+        keep = (coords[:, 0] // tile_blocks == tx) & (coords[:, 2] // tile_blocks == tz)
+        if not keep.any():
+            continue
+        if textured:
+            voxel_colors = tile_colors[keep]
+        else:
+            with _profiler.stage('color_sampling'):
+                _, nearest = cKDTree(tile_vertices).query(points[keep], workers=-1)
+                voxel_colors = np.ascontiguousarray(colors[vertex_ids][nearest])
+        yield tile_index, len(starts), coords[keep], voxel_colors
 
 # Calculate rotation matrix
 def calculate_rotation_matrix(rotate_angle=ROTATE_ANGLE, pitch=PITCH):
@@ -209,54 +740,743 @@ def calculate_rotation_matrix(rotate_angle=ROTATE_ANGLE, pitch=PITCH):
     rotation_matrix = dot(rz_matrix, dot(ry_matrix, rx_matrix))
     return rotation_matrix / pitch
 
+# Compact voxel model: int32 world coordinates and uint8 indices into the block names, cheap to pickle and cache
+class VoxelModel:
+    def __init__(self, x, y, z, block_indices, block_names):
+        self.x = np.ascontiguousarray(x, dtype=np.int32)
+        self.y = np.ascontiguousarray(y, dtype=np.int32)
+        self.z = np.ascontiguousarray(z, dtype=np.int32)
+        self.block_indices = np.ascontiguousarray(block_indices, dtype=np.uint8)
+        self.block_names = list(block_names)
+
+    @classmethod
+    def from_coords(cls, coords, block_indices, block_names):
+        coords = np.asarray(coords).reshape(-1, 3)
+        return cls(coords[:, 0], coords[:, 1], coords[:, 2], block_indices, block_names)
+
+    # Concatenate models sharing the same block names
+    @classmethod
+    def concatenate(cls, models, block_names):
+        models = list(models)
+        return cls(*(np.concatenate([getattr(model, name) for model in models] or [[]]) for name in ('x', 'y', 'z', 'block_indices')), block_names)
+
+    def __len__(self):
+        return len(self.block_indices)
+
+    @property
+    def coords(self):
+        return np.stack([self.x, self.y, self.z], axis=1)
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + self.y.nbytes + self.z.nbytes + self.block_indices.nbytes
+
+    # Get the minimum and maximum world coordinates
+    def bounds(self):
+        coords = self.coords
+        return coords.min(axis=0), coords.max(axis=0)
+
+    def subset(self, index):
+        return VoxelModel(self.x[index], self.y[index], self.z[index], self.block_indices[index], self.block_names)
+
+    # Pack the coordinates of models into one int64 per cell relative to their common bounds, for set operations between them
+    # Raises ValueError when the bounds hold more cells than an int64 can index
+    @classmethod
+    def keys(cls, *models):
+        coords = [model.coords.astype(np.int64) for model in models]
+        occupied = [model_coords for model_coords in coords if len(model_coords)]
+        if not occupied:
+            return [np.zeros(0, dtype=np.int64) for _ in models]
+        low = np.min([model_coords.min(axis=0) for model_coords in occupied], axis=0)
+        shape = tuple(np.max([model_coords.max(axis=0) for model_coords in occupied], axis=0) - low + 1)
+        return [np.ravel_multi_index((model_coords - low).T, shape).astype(np.int64) for model_coords in coords]
+
+    # Re-index the blocks into other block names, which must contain the names of this model
+    def remap(self, block_names):
+        lookup = np.array([block_names.index(name) for name in self.block_names] or [0], dtype=np.uint8)
+        return VoxelModel(self.x, self.y, self.z, lookup[self.block_indices], block_names)
+
+    # Merge models sharing the same block names, later models win where models overlap
+    @classmethod
+    def merge(cls, models, block_names):
+        model = cls.concatenate(list(models)[::-1], block_names)
+        _, first = np.unique(model.coords, axis=0, return_index=True)
+        return model.subset(np.sort(first))
+
+    # Split into chunk-keyed sparse storage: {(cx, cz): VoxelModel} in chunk order, sorted by section within each chunk
+    def chunks(self):
+        cx, cz = self.x >> 4, self.z >> 4
+        order = np.lexsort((self.y >> 4, cz, cx))
+        model, cx, cz = self.subset(order), cx[order], cz[order]
+        bounds = np.flatnonzero((cx[1:] != cx[:-1]) | (cz[1:] != cz[:-1])) + 1
+        starts, ends = np.concatenate(([0], bounds)), np.concatenate((bounds, [len(model)]))
+        if len(model) == 0:
+            return {}
+        return {(int(cx[start]), int(cz[start])): model.subset(slice(start, end)) for start, end in zip(starts, ends)}
+
+# Translate each block name of the table to the universal format, cached for the whole process
+_parsed_blocks = {}
+_universal_blocks = {}
+def translate_blocks(world, block_names, game_version=GAME_VERSION):
+    from amulet.api.block import Block
+    translator = None
+    universal_blocks = []
+    for block_name in block_names:
+        key = (block_name, game_version)
+        if key not in _universal_blocks:
+            if block_name not in _parsed_blocks:
+                _parsed_blocks[block_name] = Block.from_string_blockstate(block_name)
+            if translator is None:
+                translator = world.translation_manager.get_version(*game_version).block
+            src_blocks = _parsed_blocks[block_name].block_tuple
+            universal_block = translator.to_universal(src_blocks[0])[0]
+            for src_block in src_blocks[1:]:
+                universal_block += translator.to_universal(src_block)[0]
+            _universal_blocks[key] = universal_block
+        universal_blocks.append(_universal_blocks[key])
+    return universal_blocks
+
+# Write a voxel model to the world chunk by chunk, chunks are snapshotted into the backup first if one is given
+def write_blocks(world, model, game_version=GAME_VERSION, dimension=None, call_back=call_back_null, stage_index=0, stage_num=1, backup=None):
+    if dimension is None:
+        dimension = world.dimensions[0]
+    if len(model) == 0:
+        return 0
+    if backup is not None:
+        with _profiler.stage('backup'):
+            backup.snapshot(model)
+    with _profiler.stage('world_write'):
+        return _write_chunks(world, model, game_version, dimension, call_back, stage_index, stage_num)
+
+# Write the chunks of a voxel model, see write_blocks
+def _write_chunks(world, model, game_version, dimension, call_back, stage_index, stage_num):
+    from amulet.api.errors import ChunkDoesNotExist
+    universal_blocks = translate_blocks(world, model.block_names, game_version)
+    chunks = model.chunks()
+    _profiler.touched_chunks.update(chunks)
+    _profiler.unique_blocks.update(model.block_names[i] for i in np.unique(model.block_indices))
+    written = 0
+    for (cx, cz), chunk_model in chunks.items():
+        try:
+            chunk = world.get_chunk(cx, cz, dimension)
+        except ChunkDoesNotExist:
+            chunk = world.create_chunk(cx, cz, dimension)
+
+        # Register each distinct block in the chunk palette once
+        palette_map = np.zeros(len(model.block_names), dtype=np.uint32)
+        for index in np.unique(chunk_model.block_indices):
+            palette_map[index] = chunk.block_palette.get_add_block(universal_blocks[index])
+        chunk_ids = palette_map[chunk_model.block_indices]
+
+        # Assign the sections with fancy indexing
+        x, y, z = chunk_model.x & 15, chunk_model.y, chunk_model.z & 15
+        cy = y >> 4
+        for section_y in np.unique(cy):
+            mask = cy == section_y
+            section = chunk.blocks.get_sub_chunk(int(section_y))
+            section[x[mask], y[mask] & 15, z[mask]] = chunk_ids[mask]
+
+        # Placed blocks replace any block entity at their location
+        if len(chunk.block_entities):
+            placed = set(map(tuple, chunk_model.coords.tolist()))
+            for location in [location for location in chunk.block_entities.keys() if location in placed]:
+                del chunk.block_entities[location]
+        chunk.changed = True
+        written += len(chunk_model)
+        call_back(stage_index, stage_num, len(model)+written, len(model)*2)
+    return len(chunks)
+
+# Transform voxel points to integer world coordinates in one matrix multiply
+def transform_points(points, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH):
+    with _profiler.stage('transform'):
+        rotation_matrix = calculate_rotation_matrix(rotate_angle, pitch)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        return np.rint(points @ rotation_matrix.T + np.asarray(start_pos, dtype=np.float64)).astype(np.int32)
+
+# Merge voxels that land in the same world cell, the most frequent block of the cell survives (lowest index on ties)
+def dedupe_voxels(coords, block_indices):
+    coords = np.asarray(coords).reshape(-1, 3)
+    block_indices = np.asarray(block_indices)
+    _profiler.count('voxels', len(coords))
+    if len(coords) == 0:
+        return coords, block_indices
+    order = np.lexsort((block_indices, coords[:, 2], coords[:, 1], coords[:, 0]))
+    coords, block_indices = coords[order], block_indices[order]
+    new_cell = np.ones(len(coords), dtype=bool)
+    new_cell[1:] = (coords[1:] != coords[:-1]).any(axis=1)
+    new_run = new_cell.copy()
+    new_run[1:] |= block_indices[1:] != block_indices[:-1]
+
+    # Count each run of equal blocks within a cell and keep the longest run per cell
+    run_starts = np.flatnonzero(new_run)
+    run_counts = np.diff(np.append(run_starts, len(coords)))
+    run_cells = np.cumsum(new_cell)[run_starts] - 1
+    run_order = np.lexsort((-run_counts, run_cells))
+    first = np.ones(len(run_order), dtype=bool)
+    first[1:] = run_cells[run_order][1:] != run_cells[run_order][:-1]
+    survivors = run_starts[run_order[first]]
+    _profiler.count('duplicate_writes', len(coords) - len(survivors))
+    return coords[survivors], block_indices[survivors]
+
+# Build the voxel model of voxel points and colors: match blocks, stamp instances, transform and merge colliding voxels
+def build_voxel_model(points, voxel_colors, block_table, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH, use_lut=False, transforms=None):
+    block_indices = find_closest_blocks(voxel_colors, block_table, use_lut)
+    if transforms is not None:
+        with _profiler.stage('transform'):
+            points, block_indices = stamp_instances(points, block_indices, transforms)
+    coords = transform_points(points, start_pos, rotate_angle, pitch)
+    with _profiler.stage('dedupe'):
+        model = VoxelModel.from_coords(*dedupe_voxels(coords, block_indices), block_table[0])
+    print(f"Merged colliding voxels, {len(coords) - len(model)} redundant writes saved")
+    return model
+
 # Insert blocks
-def insert_blocks(points, colors, tree, world, palette, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH, game_version=GAME_VERSION, call_back=call_back_null, stage_index=0, stage_num=1):
+def insert_blocks(points, voxel_colors, world, block_table, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH, game_version=GAME_VERSION, call_back=call_back_null, stage_index=0, stage_num=1, use_lut=False, transforms=None):
     dimension = world.dimensions[0]
+    model = build_voxel_model(points, voxel_colors, block_table, start_pos, rotate_angle, pitch, use_lut, transforms)
+
+    # Place blocks
+    chunk_num = write_blocks(world, model, game_version, dimension, call_back, stage_index, stage_num)
+    print(f"Successfully placed {len(model)} blocks in {chunk_num} chunks")
+    return len(model)
+
+# Voxelize a mesh with its instances into a voxel model, runs in a worker process in parallel mode
+def match_mesh(mesh, transforms, block_table, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH, use_lut=False, use_cache=True, sampler=SAMPLER, reduction=POINT_REDUCTION):
+    points, voxel_colors = voxelize_model(mesh, get_instance_pitch(transforms, pitch), use_cache, sampler, reduction)
+    return build_voxel_model(points, voxel_colors, block_table, start_pos, rotate_angle, pitch, use_lut, transforms)
+
+# Run match_mesh or match_entry in a worker process, returns the model with the stage timings and counters of the worker
+def run_profiled(function, *args):
+    _profiler.current = Profiler()
+    model = function(*args)
+    return model, _profiler.stages, _profiler.counters
+
+# Generate the voxel models of all meshes, yields (mesh index, model, tile index, tile count)
+# Meshes come from a process pool in parallel mode and tile by tile in tiled mode, tile index and count are None otherwise
+def generate_voxel_models(meshes, block_table, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH, use_lut=False, use_cache=True, tile_size=TILE_SIZE, workers=WORKERS, call_back=call_back_null, sampler=SAMPLER, reduction=POINT_REDUCTION):
+    if workers != 1 and not tile_size and len(meshes) > 1:
+        # Voxelize and color-match meshes in a process pool while the caller consumes finished meshes
+        print(f"Processing {len(meshes)} meshes in parallel...")
+        with ProcessPoolExecutor(max_workers=workers or None) as pool:
+            futures = {pool.submit(run_profiled, match_mesh, mesh, transforms, block_table, start_pos, rotate_angle, pitch, use_lut, use_cache, sampler, reduction): i for i, (mesh, transforms) in enumerate(meshes)}
+            # Yield in mesh order so later meshes still win where meshes overlap, holding meshes that finish early
+            finished = {}
+            next_index = 0
+            for future in as_completed(futures):
+                finished[futures[future]] = future.result()
+                while next_index in finished:
+                    model, stages, counters = finished.pop(next_index)
+                    _profiler.merge(stages, counters)  # Worker stage times add up across processes
+                    yield next_index, model, None, None
+                    next_index += 1
+        return
+    import trimesh
+    for i, (mesh, transforms) in enumerate(meshes):
+        if tile_size and type(mesh) != trimesh.PointCloud:
+            # Stream each instance tile by tile, point clouds are already voxelized chunk by chunk
+            for transform in transforms:
+                instance = mesh if np.allclose(transform, np.eye(4)) else mesh.copy().apply_transform(transform)
+                for tile_index, tile_num, coords, voxel_colors in voxelize_tiles(instance, start_pos, rotate_angle, pitch, tile_size, sampler):
+                    block_indices = find_closest_blocks(voxel_colors, block_table, use_lut)
+                    with _profiler.stage('dedupe'):
+                        model = VoxelModel.from_coords(*dedupe_voxels(coords, block_indices), block_table[0])
+                    yield i, model, tile_index, tile_num
+        else:
+            points, voxel_colors = voxelize_model(mesh, get_instance_pitch(transforms, pitch), use_cache, sampler, reduction)
+            call_back(len(meshes)+i+1, len(meshes)*2+1, len(points)-1, len(points)*2)
+            yield i, build_voxel_model(points, voxel_colors, block_table, start_pos, rotate_angle, pitch, use_lut, transforms), None, None
+
+# Placement manifest of a model file or batch manifest in a world, named after the file and a hash of its path
+def get_placement_file(world_path, source_file):
+    name = os.path.splitext(os.path.basename(source_file))[0]
+    source_hash = hashlib.md5(os.path.abspath(source_file).encode()).hexdigest()[:8]
+    return os.path.join(world_path, PLACEMENT_DIR, f'{name}_{source_hash}.npz')
+
+# Load the model placed by the previous incremental run, returns None if there is none
+def load_placement(placement_file):
+    if not os.path.exists(placement_file):
+        return None
+    try:
+        with np.load(placement_file) as data:
+            return VoxelModel(data['x'], data['y'], data['z'], data['block_indices'], [str(name) for name in data['block_names']])
+    except (OSError, ValueError, KeyError):
+        print(f"Ignoring unreadable placement manifest {placement_file}")
+        return None
+
+def save_placement(placement_file, model):
+    os.makedirs(os.path.dirname(placement_file), exist_ok=True)
+    temp_file = f'{placement_file}.{os.getpid()}.tmp.npz'
+    np.savez_compressed(temp_file, x=model.x, y=model.y, z=model.z, block_indices=model.block_indices, block_names=np.array(model.block_names))
+    os.replace(temp_file, placement_file)
+
+# Diff a model against the previous placement: cells whose block changed, plus air for cells that are no longer occupied
+def diff_placement(previous, model):
+    block_names = model.block_names + [name for name in previous.block_names + ['minecraft:air'] if name not in model.block_names]
+    model, previous = model.remap(block_names), previous.remap(block_names)
+    keys, previous_keys = VoxelModel.keys(model, previous)
+    _, index, previous_index = np.intersect1d(keys, previous_keys, assume_unique=True, return_indices=True)
+    unchanged = index[model.block_indices[index] == previous.block_indices[previous_index]]
+    changed = np.ones(len(model), dtype=bool)
+    changed[unchanged] = False
+    stale = previous.subset(~np.isin(previous_keys, keys))
+    air = VoxelModel(stale.x, stale.y, stale.z, np.full(len(stale), block_names.index('minecraft:air')), block_names)
+    _profiler.count('unchanged_blocks', len(unchanged))
+    _profiler.count('cleared_blocks', len(air))
+    print(f"Incremental placement: {int(changed.sum())} changed, {len(air)} cleared, {len(unchanged)} unchanged blocks")
+    return VoxelModel.concatenate([model.subset(changed), air], block_names)
+
+# Write only what changed since the previous placement of the model
+# Returns the number of chunks written, of blocks placed and of blocks cleared
+def write_incremental(world, model, placement_file, game_version=GAME_VERSION, call_back=call_back_null, stage_index=0, stage_num=1, backup=None):
+    previous = load_placement(placement_file)
+    cleared = 0
+    if previous is not None:
+        with _profiler.stage('dedupe'):
+            model = diff_placement(previous, model)
+        cleared = int(np.count_nonzero(model.block_indices == model.block_names.index('minecraft:air')))
+    if backup is not None:
+        backup.keep_placement(placement_file)
+    return write_blocks(world, model, game_version, None, call_back, stage_index, stage_num, backup), len(model) - cleared, cleared
+
+def get_backup_dir(world_path):
+    return os.path.join(world_path, PLACEMENT_DIR, 'backups')
+
+# Name a new backup file, names sort by creation time and stay unique for runs of one process within the same second
+_backup_numbers = itertools.count()
+def get_backup_name():
+    seconds, nanoseconds = divmod(time.time_ns(), 1_000_000_000)
+    return f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(seconds))}-{nanoseconds:09d}-{os.getpid()}-{next(_backup_numbers):04d}.nbt"
+
+# Raw on-disk data of the chunks a run touches, taken before their first write, so the run can be rolled back
+# The backup file is a header record followed by one record per chunk or placement manifest, each compressed on its own.
+# Records are appended to a temporary file as they are taken, so memory doesn't grow with the footprint of the model
+class ChunkBackup:
+    def __init__(self, world, world_path, dimension=None):
+        self.world = world
+        self.world_path = world_path
+        self.backup_file = os.path.join(get_backup_dir(world_path), get_backup_name())
+        self.temp_file = f'{self.backup_file}.tmp'
+        self.dimension = dimension if dimension is not None else world.dimensions[0]
+        self.chunks = set()  # Chunks already in the backup
+        self.placements = set()  # Placement manifests already in the backup
+        self.started = False
+        self.remove_stale()
+
+    # Remove the temporary files of runs that were terminated before saving, e.g. by the GUI after a cancel timeout.
+    # Only one conversion writes a world at a time, so no other temporary file is still in use
+    def remove_stale(self):
+        backup_dir = os.path.dirname(self.backup_file)
+        if os.path.isdir(backup_dir):
+            for name in os.listdir(backup_dir):
+                if name.endswith('.nbt.tmp'):
+                    os.remove(os.path.join(backup_dir, name))
+
+    # Append records to the temporary file, starting the backup with its header
+    def append(self, records):
+        from amulet_nbt import NamedTag, CompoundTag, StringTag
+        os.makedirs(os.path.dirname(self.backup_file), exist_ok=True)
+        with open(self.temp_file, 'ab') as f:
+            if not self.started:
+                f.write(NamedTag(CompoundTag({'Dimension': StringTag(self.dimension)})).to_nbt())
+                self.started = True
+            for record in records:
+                f.write(NamedTag(record).to_nbt())
+
+    # Snapshot the chunks covered by a model which are not in the backup yet. Chunks still hold their
+    # data from before the run on disk, since any chunk written and saved by the run was snapshotted first
+    def snapshot(self, model):
+        self.append(self.chunk_records(model))
+
+    def chunk_records(self, model):
+        from amulet_nbt import CompoundTag, IntTag
+        wrapper = self.world.level_wrapper
+        for cx, cz in np.unique(np.stack([model.x >> 4, model.z >> 4], axis=1), axis=0).tolist():
+            if (cx, cz) not in self.chunks:
+                self.chunks.add((cx, cz))
+                record = CompoundTag({'x': IntTag(cx), 'z': IntTag(cz)})
+                if wrapper.has_chunk(cx, cz, self.dimension):
+                    record['Data'] = wrapper.get_raw_chunk_data(cx, cz, self.dimension).compound
+                yield record
+
+    def keep_placement(self, placement_file):
+        from amulet_nbt import CompoundTag, StringTag, ByteArrayTag
+        if placement_file not in self.placements:
+            self.placements.add(placement_file)
+            record = CompoundTag({'Path': StringTag(os.path.relpath(placement_file, self.world_path))})
+            if os.path.exists(placement_file):
+                with open(placement_file, 'rb') as f:
+                    record['Data'] = ByteArrayTag(np.frombuffer(f.read(), dtype=np.int8))
+            self.append([record])
+
+    # Move the records taken so far into the backup file, must be called before the world is saved
+    def save(self, limit=BACKUP_LIMIT):
+        if not os.path.exists(self.temp_file):
+            return
+        if os.path.exists(self.backup_file):
+            with open(self.temp_file, 'rb') as source, open(self.backup_file, 'ab') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(self.temp_file)
+        else:
+            os.replace(self.temp_file, self.backup_file)
+        print(f"Backed up {len(self.chunks)} chunks to {self.backup_file}")
+
+        backup_dir = os.path.dirname(self.backup_file)
+        backups = sorted(name for name in os.listdir(backup_dir) if name.endswith('.nbt'))
+        for name in backups[:max(len(backups) - limit, 0)]:
+            os.remove(os.path.join(backup_dir, name))
+
+    # Drop the records not saved yet, their chunks are not saved to the world either
+    def discard(self):
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+
+# Back up the chunks of a run, returns None with a warning for worlds other than Java (Anvil) ones, which keep chunks in another format
+def create_backup(world, world_path):
+    from amulet.level.formats.anvil_world import AnvilFormat
+    if not isinstance(world.level_wrapper, AnvilFormat):
+        print(f"Warning: chunk backups only support Java worlds, writing this {type(world.level_wrapper).__name__} world without a backup")
+        return None
+    return ChunkBackup(world, world_path)
+
+def list_backups(world_path):
+    backup_dir = get_backup_dir(world_path)
+    if not os.path.isdir(backup_dir):
+        return []
+    return [os.path.join(backup_dir, name) for name in sorted(os.listdir(backup_dir)) if name.endswith('.nbt')]
+
+# Restore the chunks and placement manifests of a backup, the latest one by default, and delete the backup
+def rollback(world_path, backup_file=None):
+    import amulet_nbt
+    from amulet import load_level
+    from amulet_nbt import NamedTag
+    if backup_file is None:
+        backups = list_backups(world_path)
+        if not backups:
+            raise FileNotFoundError(f"No backups found in {get_backup_dir(world_path)}")
+        backup_file = backups[-1]
+    print(f"Rolling back {backup_file}...")
+    header, *records = [tag.compound for tag in amulet_nbt.load_array(backup_file, count=-1)]
+    dimension = str(header['Dimension'])
+    chunks = [record for record in records if 'Path' not in record]
+    placements = [record for record in records if 'Path' in record]
+
+    world = load_level(world_path)
+    try:
+        wrapper = world.level_wrapper
+        for record in chunks:
+            cx, cz = int(record['x']), int(record['z'])
+            if 'Data' in record:
+                wrapper.put_raw_chunk_data(cx, cz, NamedTag(record['Data']), dimension)
+            elif wrapper.has_chunk(cx, cz, dimension):
+                wrapper.delete_chunk(cx, cz, dimension)
+        wrapper.save()
+    finally:
+        world.close()
+
+    for record in placements:
+        placement_file = os.path.join(world_path, str(record['Path']))
+        if 'Data' in record:
+            with open(placement_file, 'wb') as f:
+                f.write(record['Data'].np_array.tobytes())
+        elif os.path.exists(placement_file):
+            os.remove(placement_file)
+    os.remove(backup_file)
+    print(f"Restored {len(chunks)} chunks")
+
+# Get the world height range (min y, max y exclusive) of a game version
+def get_world_height(game_version=GAME_VERSION):
+    return (-64, 320) if tuple(game_version[1]) >= (1, 18, 0) else (0, 256)
+
+# Get the minimum and maximum world coordinates covered by all instances of the meshes, None if they have no vertices
+def get_model_bounds(meshes, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH):
     rotation_matrix = calculate_rotation_matrix(rotate_angle, pitch)
-    for i, point in enumerate(points):
-        # Calculate real world coordinates
-        world_x, world_y, world_z = dot(rotation_matrix, point) + start_pos
-        world_x, world_y, world_z = map(round, (world_x, world_y, world_z))
-
-        # Get voxel color
-        voxel_color = get_voxel_color(point, colors, tree)
-        # Find closest block
-        closest_block = find_closest_block(voxel_color, palette)
-
-        # Place block
-        block = Block.from_string_blockstate(closest_block)
-        #block = Block("minecraft", "stone")
-        world.set_version_block(
-            world_x,  # x location
-            world_y,  # y location
-            world_z,  # z location
-            dimension,
-            game_version,
-            block,
-        )
-        call_back(stage_index, stage_num, len(points)+i, len(points)*2)
-    print(f"Successfully placed {len(points)} blocks")
-
-# Main function
-def model_to_minecraft(obj_file, world_path, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH, game_version=GAME_VERSION, wool=True, concrete=True, terracotta=True, glass=True, call_back=call_back_null):
-    global find_closest_block
-    find_closest_block = get_block_function(wool, concrete, terracotta, glass)
-    palette = get_palette(wool, concrete, terracotta)
-
-    meshes = load_model(obj_file)
+    corners = []
+    for mesh, transforms in meshes:
+        if len(mesh.vertices) == 0:
+            continue
+        for transform in transforms:
+            world_vertices = (mesh.vertices @ transform[:3, :3].T + transform[:3, 3]) @ rotation_matrix.T
+            corners += [world_vertices.min(axis=0), world_vertices.max(axis=0)]
+    if not corners:
+        return None
+    corners = np.array(corners) + np.asarray(start_pos, dtype=np.float64)
+    return corners.min(axis=0), corners.max(axis=0)
+
+# Voxelize every mesh coarsely to measure its block density, surface voxel counts grow with 1 / pitch²,
+# returns the density K with which a pitch places about K / pitch² blocks
+def probe_block_density(meshes, probe_blocks=PROBE_BLOCKS):
+    import trimesh
+    density = 0.0
+    for mesh, transforms in meshes:
+        if type(mesh) == trimesh.PointCloud:
+            # Scans sample surfaces, so their voxels grow the same way. The probe is coarse enough for a subsample
+            # of the points to fill every voxel they touch, with tens of points per voxel
+            sample = mesh.vertices[::max(1, len(mesh.vertices) // (probe_blocks * 64))]
+            probe_pitch = np.ptp(sample, axis=0).max() / np.sqrt(max(1, min(probe_blocks, len(sample) // 64)))
+            if probe_pitch == 0:
+                continue
+            with _profiler.stage('voxelize'):
+                cells = quantize_points(sample, probe_pitch)
+                cells -= cells.min(axis=0)
+                count = len(np.unique(np.ravel_multi_index(cells.T, tuple(cells.max(axis=0) + 1))))
+        elif mesh.area == 0:
+            continue
+        else:
+            probe_pitch = np.sqrt(mesh.area / probe_blocks)
+            with _profiler.stage('voxelize'):
+                count = len(mesh.voxelized(pitch=probe_pitch).sparse_indices)
+        density += count * (probe_pitch * get_uniform_scale(transforms[0])) ** 2 * len(transforms)
+    return density
+
+# Choose the finest pitch that keeps the estimated block count within max_blocks and the longest side within target_size blocks
+def choose_pitch(meshes, rotate_angle=ROTATE_ANGLE, max_blocks=0, target_size=0):
+    density = probe_block_density(meshes)
+    if density == 0:
+        raise ValueError("The model has no surface to choose a pitch for, set the pitch instead of a block budget or target size")
+    candidates = []
+    if max_blocks:
+        candidates.append(np.sqrt(density / max_blocks))
+    if target_size:
+        low, high = get_model_bounds(meshes, (0, 0, 0), rotate_angle, 1.0)
+        candidates.append((high - low).max() / target_size)
+    pitch = round_pitch(max(candidates))
+    print(f"Chose pitch {pitch}, about {density / pitch ** 2:.0f} blocks estimated")
+    return pitch
+
+# Round a pitch up to three significant digits, so a budget it was derived from still holds
+def round_pitch(pitch):
+    step = 10.0 ** (np.floor(np.log10(pitch)) - 2)
+    return float(f'{np.ceil(pitch / step) * step:.3g}')
+
+# Coarsen the pitch of a preview when the model would exceed the preview block budget
+def get_preview_pitch(meshes, pitch=PITCH):
+    density = probe_block_density(meshes, PREVIEW_PROBE_BLOCKS)
+    if density / pitch ** 2 <= PREVIEW_BLOCKS:
+        return pitch
+    preview_pitch = round_pitch(np.sqrt(density / PREVIEW_BLOCKS))
+    print(f"Previewing at pitch {preview_pitch} instead of {pitch}, about {density / preview_pitch ** 2:.0f} blocks estimated")
+    return preview_pitch
+
+# Abort before voxelizing when the model would not fit within the world height
+def check_height(meshes, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH, game_version=GAME_VERSION):
+    bounds = get_model_bounds(meshes, start_pos, rotate_angle, pitch)
+    if bounds is None:
+        return
+    low, high = bounds
+    min_y, max_y = get_world_height(game_version)
+    if np.rint(low[1]) < min_y or np.rint(high[1]) >= max_y:
+        raise ValueError(f"The model spans y {np.rint(low[1]):.0f} to {np.rint(high[1]):.0f} at pitch {pitch}, outside the world height {min_y} to {max_y - 1}. Move the start position, or use a larger pitch or a smaller target size")
+
+# Import the heavy dependencies ahead of their first use, e.g. while the user fills in the GUI form
+def warm_up():
+    import trimesh
+    import amulet
+    from scipy.spatial import cKDTree
+
+# Main function, returns the profiling report of the run
+def model_to_minecraft(obj_file, world_path, start_pos=START_POS, rotate_angle=ROTATE_ANGLE, pitch=PITCH, game_version=GAME_VERSION, wool=True, concrete=True, terracotta=True, glass=True, call_back=call_back_null, use_lut=False, use_cache=True, tile_size=TILE_SIZE, workers=WORKERS, save_interval=SAVE_INTERVAL, output_format='world', incremental=False, backup=True, sampler=SAMPLER, max_blocks=0, target_size=0, preview=None, reduction=POINT_REDUCTION, world=None, profiler=None):
+    return run_conversion(profiler, convert_model, obj_file, world_path, start_pos, rotate_angle, pitch, game_version, wool, concrete, terracotta, glass, call_back, use_lut, use_cache, tile_size, workers, save_interval, output_format, incremental, backup, sampler, max_blocks, target_size, preview, reduction, world)
+
+# Convert every model of a manifest into one world or output file, returns the profiling report of the run
+def batch_to_minecraft(manifest_file, world_path, game_version=GAME_VERSION, call_back=call_back_null, use_lut=False, use_cache=True, workers=WORKERS, output_format='world', defaults=None, incremental=False, backup=True, sampler=SAMPLER, reduction=POINT_REDUCTION, profiler=None):
+    return run_conversion(profiler, convert_batch, manifest_file, world_path, game_version, call_back, use_lut, use_cache, workers, output_format, defaults, incremental, backup, sampler, reduction)
+
+# Run a conversion timed by a profiler, which is reported at the end
+def run_conversion(profiler, convert, *args):
+    _profiler.current = profiler if profiler is not None else Profiler()
+    _profiler.start()
+    try:
+        convert(*args)
+    finally:
+        report = _profiler.stop()
+    print(f"Stage timings: {_profiler.summary()}")
+    print(f"Peak memory usage of the process: {report['peak_memory'] / (1 << 20):.1f} MB")
+    print("All done! Enjoy your Minecraft model!")
+    print('-'*20)
+    return report
+
+# Run the conversion stages, timed by the profiler of the run
+def convert_model(obj_file, world_path, start_pos, rotate_angle, pitch, game_version, wool, concrete, terracotta, glass, call_back, use_lut, use_cache, tile_size, workers, save_interval, output_format, incremental, backup, sampler, max_blocks, target_size, preview, reduction, world):
+    block_table = get_block_table(wool, concrete, terracotta, glass)
+
+    with _profiler.stage('load'):
+        meshes = load_model(obj_file)
+    _profiler.count('meshes', len(meshes))
+    _profiler.count('instances', sum(len(transforms) for _, transforms in meshes))
+    if max_blocks or target_size:
+        pitch = choose_pitch(meshes, rotate_angle, max_blocks, target_size)
+    if preview:
+        pitch = get_preview_pitch(meshes, pitch)
+    elif output_format in ('world', 'datapack'):
+        check_height(meshes, start_pos, rotate_angle, pitch, game_version)
     call_back(len(meshes)-1, len(meshes)*2+1, 0, 1)
+    models = generate_voxel_models(meshes, block_table, start_pos, rotate_angle, pitch, use_lut, use_cache, tile_size, workers, call_back, sampler, reduction)
 
-    print("Connecting to Minecraft world...")
-    world = load_level(world_path)
-    call_back(len(meshes), len(meshes)*2+1, 0, 1)
+    if preview or output_format != 'world':
+        # Render a preview or export a structure file without opening a world, later meshes win where meshes overlap
+        call_back(len(meshes), len(meshes)*2+1, 0, 1)
+        parts = []
+        for i, model, tile_index, tile_num in models:
+            parts.append(model)
+            call_back(len(meshes)+i+1, len(meshes)*2+1, 1, 1)
+        with _profiler.stage('preview' if preview else 'export'):
+            model = VoxelModel.merge(parts, block_table[0])
+            _profiler.count('blocks', len(model))
+            _profiler.unique_blocks.update(model.block_names[i] for i in np.unique(model.block_indices))
+            if preview:
+                from preview import render_preview
+                render_preview(model, preview, get_block_colors(model.block_names))
+            else:
+                from export import export_model
+                export_model(model, world_path, output_format, game_version)
+    else:
+        # A world opened by the caller stays open, the caller discards its unsaved changes when the conversion fails
+        own_world = world is None
+        if own_world:
+            from amulet import load_level
+            print("Connecting to Minecraft world...")
+            with _profiler.stage('world_load'):
+                world = load_level(world_path)
+        backup = create_backup(world, world_path) if backup else None
+        try:
+            call_back(len(meshes), len(meshes)*2+1, 0, 1)
+            placed = cleared = chunk_num = 0
+            if incremental:
+                # The whole model is needed to diff it against the previous placement, later meshes win where meshes overlap
+                placement_file = get_placement_file(world_path, obj_file)
+                model = VoxelModel.merge([model for _, model, _, _ in sorted(models, key=lambda item: item[0])], block_table[0])
+                chunk_num, placed, cleared = write_incremental(world, model, placement_file, game_version, call_back, len(meshes)*2, len(meshes)*2+1, backup)
+                models = []
+            for n, (i, model, tile_index, tile_num) in enumerate(models):
+                if tile_num is None:
+                    chunk_num += write_blocks(world, model, game_version, None, call_back, len(meshes)+i+1, len(meshes)*2+1, backup)
+                else:
+                    chunk_num += write_blocks(world, model, game_version, backup=backup)
+                    call_back(len(meshes)+i+1, len(meshes)*2+1, tile_index+1, tile_num)
+                placed += len(model)
+                if save_interval and (n+1) % save_interval == 0:
+                    print("Saving world...")
+                    with _profiler.stage('world_save'):
+                        if backup is not None:
+                            backup.save()
+                        world.save()
+            _profiler.count('blocks', placed)
+            print(f"Successfully placed {placed} blocks" + (f" and cleared {cleared} blocks" if cleared else "") + f" in {chunk_num} chunks")
+
+            print("Saving world...")
+            with _profiler.stage('world_save'):
+                if backup is not None:
+                    backup.save()
+                world.save()
+            if incremental:
+                save_placement(placement_file, model)
+        finally:
+            # Unsaved changes are discarded when the conversion fails or is cancelled, along with their backup records
+            if backup is not None:
+                backup.discard()
+            if own_world:
+                world.close()
+
+# Read a JSON or TOML manifest: a list of model entries under "models", the other top-level keys are defaults of the entries
+MANIFEST_KEYS = {'obj_file': None, 'start_pos': START_POS, 'rotate_angle': ROTATE_ANGLE, 'pitch': PITCH, 'wool': True, 'concrete': True, 'terracotta': True, 'glass': True}
+def load_manifest(manifest_file, defaults=None):
+    if manifest_file.lower().endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            import tomli as tomllib
+        with open(manifest_file, 'rb') as f:
+            manifest = tomllib.load(f)
+    else:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'models': manifest}
+    shared = dict(MANIFEST_KEYS, **(defaults or {}))
+    shared.update((key, value) for key, value in manifest.items() if key != 'models')
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    entries = []
+    for i, model in enumerate(manifest.get('models', [])):
+        entry = dict(shared, **model)
+        unknown = set(entry) - set(MANIFEST_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown keys in manifest entry {i}: {', '.join(sorted(unknown))}")
+        if not entry['obj_file']:
+            raise ValueError(f"Manifest entry {i} has no obj_file")
+        entry['obj_file'] = os.path.join(base_dir, entry['obj_file'])
+        entry['start_pos'], entry['rotate_angle'] = tuple(entry['start_pos']), tuple(entry['rotate_angle'])
+        entries.append(entry)
+    return entries
 
-    for i, mesh in enumerate(meshes):
-        points, colors, tree = voxelize_model(mesh, pitch)
-        call_back(len(meshes)+i+1, len(meshes)*2+1, len(points)-1, len(points)*2)
-        insert_blocks(points, colors, tree, world, palette, start_pos, rotate_angle, pitch, game_version, call_back, len(meshes)+i+1, len(meshes)*2+1)
-    
+# Load, voxelize and match every mesh of a manifest entry into one voxel model
+# With a game version, the entry is checked against the world height before voxelizing
+def match_entry(entry, use_lut=False, use_cache=True, sampler=SAMPLER, reduction=POINT_REDUCTION, game_version=None):
+    block_table = get_block_table(entry['wool'], entry['concrete'], entry['terracotta'], entry['glass'])
+    with _profiler.stage('load'):
+        meshes = load_model(entry['obj_file'])
+    if game_version is not None:
+        try:
+            check_height(meshes, entry['start_pos'], entry['rotate_angle'], entry['pitch'], game_version)
+        except ValueError as e:
+            raise ValueError(f"{entry['obj_file']}: {e}") from None
+    models = [match_mesh(mesh, transforms, block_table, entry['start_pos'], entry['rotate_angle'], entry['pitch'], use_lut, use_cache, sampler, reduction) for mesh, transforms in meshes]
+    return VoxelModel.merge(models, block_table[0])
+
+# Convert the entries of a manifest: voxelize in parallel, merge them with later entries winning, then write chunk by chunk and save once
+def convert_batch(manifest_file, world_path, game_version, call_back, use_lut, use_cache, workers, output_format, defaults, incremental, backup, sampler, reduction):
+    entries = load_manifest(manifest_file, defaults)
+    _profiler.count('entries', len(entries))
+    print(f"Loaded manifest with {len(entries)} models")
+    models = [None] * len(entries)
+    height_version = game_version if output_format in ('world', 'datapack') else None
+    if workers != 1 and len(entries) > 1:
+        print(f"Processing {len(entries)} models in parallel...")
+        with ProcessPoolExecutor(max_workers=workers or None) as pool:
+            futures = {pool.submit(run_profiled, match_entry, entry, use_lut, use_cache, sampler, reduction, height_version): i for i, entry in enumerate(entries)}
+            for n, future in enumerate(as_completed(futures)):
+                models[futures[future]], stages, counters = future.result()
+                _profiler.merge(stages, counters)
+                call_back(n, len(entries)+1, 1, 1)
+    else:
+        for i, entry in enumerate(entries):
+            models[i] = match_entry(entry, use_lut, use_cache, sampler, reduction, height_version)
+            call_back(i, len(entries)+1, 1, 1)
+
+    # Models of different materials share the block names of all materials
+    block_names = get_block_table()[0]
+    with _profiler.stage('dedupe'):
+        model = VoxelModel.merge([model.remap(block_names) for model in models], block_names)
+    _profiler.count('blocks', len(model))
+    print(f"Merged {len(entries)} models into {len(model)} blocks")
+
+    if output_format != 'world':
+        from export import export_model
+        with _profiler.stage('export'):
+            _profiler.unique_blocks.update(model.block_names[i] for i in np.unique(model.block_indices))
+            export_model(model, world_path, output_format, game_version)
+        return
+
+    from amulet import load_level
+    print("Connecting to Minecraft world...")
+    with _profiler.stage('world_load'):
+        world = load_level(world_path)
+    backup = create_backup(world, world_path) if backup else None
+    try:
+        if incremental:
+            placement_file = get_placement_file(world_path, manifest_file)
+            chunk_num, placed, cleared = write_incremental(world, model, placement_file, game_version, call_back, len(entries), len(entries)+1, backup)
+        else:
+            chunk_num = write_blocks(world, model, game_version, None, call_back, len(entries), len(entries)+1, backup)
+            placed, cleared = len(model), 0
+        print(f"Successfully placed {placed} blocks" + (f" and cleared {cleared} blocks" if cleared else "") + f" in {chunk_num} chunks")
         print("Saving world...")
-        world.save()
-    world.close()
-    print("All done! Enjoy your Minecraft model!")
-    print('-'*20)
\ No newline at end of file
+        with _profiler.stage('world_save'):
+            if backup is not None:
+                backup.save()
+            world.save()
+        if incremental:
+            save_placement(placement_file, model)
+    finally:
+        if backup is not None:
+            backup.discard()
+        world.close()